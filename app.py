@@ -135,8 +135,8 @@ def auth():
     """Start the OAuth flow"""
     try:
         auth_url = authenticator.get_authorization_url()
-        logger.debug(f"Generated auth URL: {auth_url}")
-        logger.debug(f"Session after auth: {session}")
+        logger.debug("Generated auth URL: %s", auth_url)
+        logger.debug("Session after auth: %s", session)
         return redirect(auth_url)
     except Exception as e:
         logger.error(f"Error in auth route: {str(e)}")
@@ -11,11 +11,8 @@ def main():
         setup_logging()
         logger = logging.getLogger(__name__)
         
-        # Load config
-        config = Config()
-        
         # Initialize authenticator
-        authenticator = GmailAuthenticator(config)
+        authenticator = GmailAuthenticator(Config.get_gmail_scopes())
         
         # Get credentials
         credentials = authenticator.get_credentials()
@@ -1,21 +1,40 @@
 from datetime import datetime, timedelta, time
 import logging
+import threading
 from typing import Dict, Any, Optional, Union
 from googleapiclient.discovery import build
 from google.oauth2.credentials import Credentials
 from google.auth.credentials import Credentials as BaseCredentials
 import base64
+import google_auth_httplib2
+import httplib2
+from utils import execute_google_request
+
+# Socket timeout in seconds for Calendar API connections
+HTTP_TIMEOUT = 30
 
 class CalendarHandler:
     """Handles Google Calendar operations for email reminders"""
     
     def __init__(self, credentials: Union[Credentials, BaseCredentials], config):
         """Initialize the calendar handler with Google credentials and config"""
-        self.service = build('calendar', 'v3', credentials=credentials)
+        self.service = build('calendar', 'v3', credentials=credentials, cache_discovery=False, static_discovery=True)
         self.logger = logging.getLogger(__name__)
         self.config = config
         self.current_slot = None
+        self.credentials = credentials
+        self._slot_lock = threading.Lock()  # reminders may be created from several threads
+        self._thread_state = threading.local()
         
+    def _http_for_thread(self):
+        """Authorized HTTP client of the calling thread, since httplib2 connections are not thread-safe"""
+        http = getattr(self._thread_state, 'http', None)
+        if http is None:
+            http = self._thread_state.http = google_auth_httplib2.AuthorizedHttp(
+                self.credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT)
+            )
+        return http
+
     def _parse_time(self, time_str: str) -> time:
         """Parse time string in HH:MM format"""
         hour, minute = map(int, time_str.split(':'))
@@ -86,7 +105,7 @@ class CalendarHandler:
             
             # Check if we should create an event based on category and priority
             if not self._should_create_event(category, priority, calendar_settings):
-                self.logger.info(f"Skipping calendar event for {category} email with {priority} priority")
+                self.logger.debug("Skipping calendar event for %s email with %s priority", category, priority)
                 return None
             
             # Only create reminder if there are action items
@@ -114,7 +133,8 @@ Original Email Preview:
             settings = self.config.CALENDER_REMINDER_SETTINGS
             
             # Get next available slot
-            start_time = self._get_next_available_slot()
+            with self._slot_lock:
+                start_time = self._get_next_available_slot()
             end_time = start_time + timedelta(minutes=settings['default_duration'])
 
             event = {
@@ -140,7 +160,13 @@ Original Email Preview:
             event['colorId'] = self._get_color_id(settings['reminder_color'])
 
             # Create the event
-            created_event = self.service.events().insert(calendarId='primary', body=event).execute()
+            # An insert that hit a server error may still have gone through, so only
+            # rate-limit rejections are retried to avoid duplicate events
+            created_event = execute_google_request(
+                self.service.events().insert(calendarId='primary', body=event),
+                statuses=(429,),
+                http=self._http_for_thread()
+            )
             event_id = created_event.get('id')
             
             if event_id:
@@ -187,7 +213,7 @@ Original Email Preview:
         try:
             # First check if calendar creation is enabled
             if not calendar_settings.get('create_reminder', False):
-                self.logger.debug(f"Calendar events disabled for category: {category}")
+                self.logger.debug("Calendar events disabled for category: %s", category)
                 return False
                 
             # Get priority settings for the category
@@ -195,12 +221,12 @@ Original Email Preview:
             
             # If no specific priority settings, use default behavior (create for all)
             if not category_priorities:
-                self.logger.debug(f"No priority settings for category {category}, using default behavior")
+                self.logger.debug("No priority settings for category %s, using default behavior", category)
                 return True
                 
             # Check if the email's priority is in the allowed priorities for this category
             should_create = priority.lower() in [p.lower() for p in category_priorities]
-            self.logger.debug(f"Category: {category}, Priority: {priority}, Should create event: {should_create}")
+            self.logger.debug("Category: %s, Priority: %s, Should create event: %s", category, priority, should_create)
             return should_create
             
         except Exception as e:
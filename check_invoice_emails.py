@@ -1,4 +1,4 @@
-from gmail_handler import GmailHandler
+from gmail_handler import GmailHandler, _extract_headers
 from invoice_analyzer import InvoiceAnalyzer
 import json
 from datetime import datetime, timedelta
@@ -35,10 +35,10 @@ def decode_base64(data):
 
 def extract_email_content(msg):
     """Extract content from email message"""
-    headers = msg['payload']['headers']
-    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-    date = next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown')
+    headers = _extract_headers(msg['payload'])
+    subject = headers.get('subject', 'No Subject')
+    sender = headers.get('from', 'Unknown')
+    date = headers.get('date', 'Unknown')
 
     # Extract body and attachments
     body = 'No body'
@@ -159,18 +159,8 @@ def main():
 
         logger.info("Fetching unread emails")
 
-        # Get UNREAD label ID
-        try:
-            labels = handler.service.users().labels().list(userId='me').execute()
-            unread_label = next((label for label in labels['labels'] if label['name'] == 'UNREAD'), None)
-            if not unread_label:
-                logger.error("Could not find UNREAD label")
-                return
-            unread_label_id = unread_label['id']
-            logger.info("Found UNREAD label ID")
-        except Exception as e:
-            logger.error(f"Failed to get labels: {str(e)}")
-            return
+        # UNREAD is a system label whose ID is always 'UNREAD', so no labels lookup is needed
+        unread_label_id = 'UNREAD'
 
         # List messages with UNREAD label
         try:
@@ -203,15 +193,16 @@ def main():
         print(f"Date Range: {datetime.now().strftime('%Y-%m-%d')} to {(datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d')}")
         print("="*80 + "\n")
 
+        # Get full message details for all listed emails in batched requests
+        fetched = handler.get_messages([message['id'] for message in messages])
+
         for message in messages:
             processed_count += 1
             try:
-                # Get full message details
-                msg = handler.service.users().messages().get(
-                    userId='me',
-                    id=message['id'],
-                    format='full'
-                ).execute()
+                msg = fetched.get(message['id'])
+                if not msg:
+                    logger.error(f"Could not fetch message {message['id']}")
+                    continue
 
                 # Extract email content
                 email_content = extract_email_content(msg)
@@ -272,11 +263,12 @@ Original Email Body:
 """
                     # Get attachments
                     attachments = []
+                    attachment_contents = handler.download_attachments(
+                        message['id'],
+                        [attachment['attachmentId'] for attachment in email_content['attachments']]
+                    )
                     for attachment in email_content['attachments']:
-                        attachment_data = handler.download_attachment(
-                            message['id'],
-                            attachment['attachmentId']
-                        )
+                        attachment_data = attachment_contents.get(attachment['attachmentId'])
                         if attachment_data:
                             attachments.append({
                                 'filename': attachment['filename'],
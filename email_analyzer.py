@@ -1,50 +1,25 @@
 import json
+import functools
+import string
 from typing import Dict, Any, Optional, List, Tuple
-from openai import OpenAI
 import logging
 from config import Config
-from utils import rate_limit
+from utils import rate_limit, create_chat_completion, get_openai_client
 import os
 from dotenv import load_dotenv
 
 # Load environment variables at module level
 load_dotenv(override=True)
 
-class EmailAnalyzer:
-    """Analyzes email content to categorize and route to appropriate teams."""
-
-    def __init__(self):
-        """Initialize the EmailAnalyzer with OpenAI client and logging."""
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-            
-        self.client = OpenAI(api_key=api_key)
-        self.logger = logging.getLogger(__name__)
-        self.model = "gpt-4o"
-        self.config = Config()
-
-    def _generate_system_prompt(self) -> str:
-        """Generate system prompt based on configured categories"""
-        # Build category descriptions from config
-        category_descriptions = []
-        for cat_name, cat_config in self.config.EMAIL_CATEGORIES.items():
-            keywords = ', '.join(cat_config['keywords'])
-            priority = cat_config['priority']
-            # Use lowercase for category names in prompt
-            desc = f"- {cat_name.lower()}: Emails containing keywords [{keywords}]. Default priority: {priority}"
-            category_descriptions.append(desc)
-            
-        categories_text = '\n'.join(category_descriptions)
-        
-        return f"""You are an expert email analyzer. Your task is to:
+# System prompt template, filled in once per analyzer with the configured categories
+SYSTEM_PROMPT_TEMPLATE = string.Template("""You are an expert email analyzer. Your task is to:
 1. Analyze the email content and determine the most appropriate category(s) based on configured keywords and context
 2. Extract key information relevant to those categories
 3. Determine the priority level based on content urgency and importance
 4. Identify any project names or codes mentioned
 
 Configured Categories:
-{categories_text}
+$categories_text
 
 Priority Levels:
 - normal: Regular business communication, no immediate action needed
@@ -54,25 +29,55 @@ Priority Levels:
 IMPORTANT: Always return category names in lowercase.
 
 Respond with a JSON object in this exact format:
-{{
+{
     "categories": [
-        {{
+        {
             "name": string,  # Category name from configured categories (in lowercase)
             "confidence": float,  # Scale of 0-1
             "priority": string,  # normal/high/urgent (consider default category priority)
-            "extracted_data": {{
+            "extracted_data": {
                 "key_points": array,  # List of important points
                 "action_items": array,  # List of required actions
                 "entities": object,  # Named entities (people, companies, products)
                 "project_names": array,  # Any project names/codes mentioned
                 "deadlines": array,  # Any mentioned deadlines or important dates
                 "category_specific": object  # Category-specific extracted data
-            }}
-        }}
+            }
+        }
     ],
     "summary": string,  # Brief summary of the email
     "overall_priority": string  # normal/high/urgent (highest priority among categories)
-}}"""
+}""")
+
+class EmailAnalyzer:
+    """Analyzes email content to categorize and route to appropriate teams."""
+
+    def __init__(self):
+        """Initialize the EmailAnalyzer with OpenAI client and logging."""
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is required")
+            
+        self.client = get_openai_client(api_key)
+        self.logger = logging.getLogger(__name__)
+        self.model = "gpt-4o"
+        self.config = Config()
+        self._system_prompt = self._generate_system_prompt()
+
+    def _generate_system_prompt(self) -> str:
+        """Generate system prompt based on configured categories"""
+        # Build category descriptions from config
+        category_descriptions = []
+        for cat_name, cat_config in self.config.EMAIL_CATEGORIES.items():
+            keywords = ', '.join(cat_config['keywords'])
+            priority = cat_config.get('priority', 'normal')
+            # Use lowercase for category names in prompt
+            desc = f"- {cat_name.lower()}: Emails containing keywords [{keywords}]. Default priority: {priority}"
+            category_descriptions.append(desc)
+            
+        categories_text = '\n'.join(category_descriptions)
+        
+        return SYSTEM_PROMPT_TEMPLATE.substitute(categories_text=categories_text)
 
     def analyze_email(self, subject: str, body: str) -> Dict[str, Any]:
         """
@@ -88,15 +93,13 @@ Respond with a JSON object in this exact format:
         try:
             self.logger.info(f"Analyzing email with subject: {subject[:100]}...")
 
-            # Generate prompt based on current configuration
-            system_prompt = self._generate_system_prompt()
-
-            response = self.client.chat.completions.create(
+            response = create_chat_completion(
+                self.client,
                 model=self.model,
                 messages=[
                     {
                         "role": "system",
-                        "content": system_prompt
+                        "content": self._system_prompt
                     },
                     {
                         "role": "user",
@@ -162,3 +165,8 @@ Respond with a JSON object in this exact format:
             analysis_result['overall_priority'] in ['high', 'urgent'] or
             any(cat['name'] == 'critical' for cat in analysis_result['categories'])
         )
+
+@functools.lru_cache(maxsize=1)
+def get_analyzer() -> EmailAnalyzer:
+    """Return a process-wide EmailAnalyzer, created on first use."""
+    return EmailAnalyzer()
@@ -1,13 +1,73 @@
 import os
 import logging
-from typing import List, Dict, Any
+import functools
+import hashlib
+import string
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parseaddr
+from typing import List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel
-from openai import OpenAI
 from config import Config
+from utils import create_chat_completion, get_openai_client
 import json
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Number of classifications remembered by content hash, so recurring emails are not re-classified
+CLASSIFICATION_CACHE_SIZE = 4096
+
+# Emails packed into one OpenAI request by classify_emails, and their combined size limit
+BATCH_CLASSIFY_SIZE = 8
+BATCH_CLASSIFY_MAX_CHARS = 24000
+# Maximum number of OpenAI requests run concurrently by classify_emails
+MAX_CONCURRENT_CLASSIFICATIONS = 8
+
+# Response structure and priority rules requested for every classified email
+CLASSIFICATION_FORMAT = """{
+                "categories": ["work", "meeting", "deadline", "invoice", "report", "follow_up", "support", "project", "sales", "inquiry_lead", "personal"],
+                "priority": "urgent/important/normal/low",
+                "key_points": ["key point 1", "key point 2"],
+                "action_items": ["action 1", "action 2"],
+                "spam": true/false,
+                "alert": true/false
+            }
+            
+            Priority Guidelines:
+            - urgent: Time-sensitive matters requiring immediate attention (e.g., [URGENT] in subject, deadlines today)
+            - important: Significant but not time-critical (e.g., [IMPORTANT] in subject, deadlines this week)
+            - normal: Regular communications
+            - low: Non-critical, can be handled later
+            
+            Note: Categories should match one or more from the list above. If [URGENT] or [IMPORTANT] is in the subject, set priority accordingly."""
+
+# System prompt template, filled in once per classifier with the enabled categories
+SYSTEM_PROMPT_TEMPLATE = string.Template("""You are an expert email classifier. Analyze the email and:
+1. Identify relevant categories from: $categories
+2. Determine priority (normal/high/urgent/low) based on content urgency
+3. Identify if the email appears to be spam or a sales pitch
+4. Determine if this is an alert requiring attention or just a notification
+5. List key points and required actions
+
+Respond with a JSON object containing:
+- categories: List of identified categories
+- priority: Priority level (normal/high/urgent/low)
+- key_points: List of important points from the email
+- action_items: List of actions required
+- spam: Whether the email appears to be spam
+- alert: Whether the email is an alert requiring attention
+
+For spam detection, look for:
+- Unsolicited offers
+- Too-good-to-be-true promises
+- Urgency to act
+- Requests for sensitive information
+- Poor grammar or formatting
+- Unknown or suspicious senders
+
+For alerts vs notifications:
+- Alerts: Require immediate attention or action
+- Notifications: Informational updates only
+""")
 
 class EmailClassification(BaseModel):
     """Email classification with priority and routing information"""
@@ -33,6 +93,13 @@ class EmailClassifier:
         self.config = config or Config.from_env()
         self.logger = logging.getLogger(__name__)
         self.model = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+        self.client = get_openai_client(os.getenv("OPENAI_API_KEY"))
+        self._system_prompt = self._generate_system_prompt()
+        self._classification_cache: OrderedDict = OrderedDict()  # content hash -> classification
+        self._cache_lock = threading.Lock()
+        # Routing only depends on the sender and the category list, so resolve each once
+        self._direct_targets_for = functools.lru_cache(maxsize=256)(self._resolve_direct_targets)
+        self._category_targets_for = functools.lru_cache(maxsize=256)(self._resolve_category_targets)
 
     def _generate_system_prompt(self) -> str:
         """Generate the system prompt based on configuration"""
@@ -44,33 +111,7 @@ class EmailClassifier:
         
         categories = list(enabled_categories.keys())
         
-        return f"""You are an expert email classifier. Analyze the email and:
-1. Identify relevant categories from: {', '.join(categories)}
-2. Determine priority (normal/high/urgent/low) based on content urgency
-3. Identify if the email appears to be spam or a sales pitch
-4. Determine if this is an alert requiring attention or just a notification
-5. List key points and required actions
-
-Respond with a JSON object containing:
-- categories: List of identified categories
-- priority: Priority level (normal/high/urgent/low)
-- key_points: List of important points from the email
-- action_items: List of actions required
-- spam: Whether the email appears to be spam
-- alert: Whether the email is an alert requiring attention
-
-For spam detection, look for:
-- Unsolicited offers
-- Too-good-to-be-true promises
-- Urgency to act
-- Requests for sensitive information
-- Poor grammar or formatting
-- Unknown or suspicious senders
-
-For alerts vs notifications:
-- Alerts: Require immediate attention or action
-- Notifications: Informational updates only
-"""
+        return SYSTEM_PROMPT_TEMPLATE.substitute(categories=', '.join(categories))
 
     def _normalize_project_name(self, name: str) -> str:
         """Normalize project name for comparison"""
@@ -82,37 +123,64 @@ For alerts vs notifications:
                 normalized = normalized[len(prefix):]
         return normalized
 
+    def _cache_key(self, email_data: Dict[str, Any]) -> bytes:
+        """Hash the fields sent to the model into a compact cache key"""
+        # Display names, case and line wrapping do not change the classification, so
+        # resent and re-wrapped copies of an email share one entry
+        sender = parseaddr(email_data['sender'])[1].lower() or email_data['sender']
+        subject = ' '.join(email_data['subject'].split())
+        body = ' '.join(email_data['body'].split())
+        content = f"{subject}\0{sender}\0{body}"
+        return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+    def _cached_classification(self, cache_key: bytes) -> Optional[Dict[str, Any]]:
+        """Return a remembered classification, marking it recently used"""
+        with self._cache_lock:
+            cached = self._classification_cache.get(cache_key)
+            if cached is not None:
+                self._classification_cache.move_to_end(cache_key)
+        if cached is not None:
+            self.logger.info("Using cached classification for identical email")
+        return cached
+
+    def _store_classification(self, cache_key: bytes, result: Dict[str, Any]) -> Dict[str, Any]:
+        """Fill in missing fields of a model classification and remember it"""
+        # Ensure required fields exist
+        result.setdefault('categories', ['notification'])
+        result.setdefault('priority', 'normal')
+        result.setdefault('key_points', [])
+        result.setdefault('action_items', [])
+        result.setdefault('spam', False)
+        result.setdefault('alert', False)
+
+        with self._cache_lock:
+            self._classification_cache[cache_key] = result
+            if len(self._classification_cache) > CLASSIFICATION_CACHE_SIZE:
+                self._classification_cache.popitem(last=False)
+        return result
+
     def classify_email(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """Classify email using OpenAI API"""
         try:
+            cache_key = self._cache_key(email_data)
+            cached = self._cached_classification(cache_key)
+            if cached is not None:
+                return cached
+
             prompt = f"""
             Subject: {email_data['subject']}
             From: {email_data['sender']}
             Body: {email_data['body']}
             
             Please analyze this email and provide a JSON response with the following structure:
-            {{
-                "categories": ["work", "meeting", "deadline", "invoice", "report", "follow_up", "support", "project", "sales", "inquiry_lead", "personal"],
-                "priority": "urgent/important/normal/low",
-                "key_points": ["key point 1", "key point 2"],
-                "action_items": ["action 1", "action 2"],
-                "spam": true/false,
-                "alert": true/false
-            }}
-            
-            Priority Guidelines:
-            - urgent: Time-sensitive matters requiring immediate attention (e.g., [URGENT] in subject, deadlines today)
-            - important: Significant but not time-critical (e.g., [IMPORTANT] in subject, deadlines this week)
-            - normal: Regular communications
-            - low: Non-critical, can be handled later
-            
-            Note: Categories should match one or more from the list above. If [URGENT] or [IMPORTANT] is in the subject, set priority accordingly.
+            {CLASSIFICATION_FORMAT}
             """
             
-            response = client.chat.completions.create(
+            response = create_chat_completion(
+                self.client,
                 model="gpt-3.5-turbo",
                 messages=[
-                    {"role": "system", "content": self._generate_system_prompt()},
+                    {"role": "system", "content": self._system_prompt},
                     {"role": "user", "content": prompt}
                 ]
             )
@@ -124,15 +192,7 @@ For alerts vs notifications:
             if isinstance(result, str):
                 result = json.loads(result)
             
-            # Ensure required fields exist
-            result.setdefault('categories', ['notification'])
-            result.setdefault('priority', 'normal')
-            result.setdefault('key_points', [])
-            result.setdefault('action_items', [])
-            result.setdefault('spam', False)
-            result.setdefault('alert', False)
-            
-            return result
+            return self._store_classification(cache_key, result)
             
         except Exception as e:
             self.logger.error(f"Error in email classification: {str(e)}")
@@ -145,51 +205,125 @@ For alerts vs notifications:
                 'alert': False
             }
 
+    def classify_emails(self, emails: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Classify several emails, packing them into shared OpenAI requests, in input order"""
+        results: List[Optional[Dict[str, Any]]] = [None] * len(emails)
+        chunks: List[List[Tuple[int, bytes]]] = []
+        chunk_chars = 0
+        for index, email_data in enumerate(emails):
+            cache_key = self._cache_key(email_data)
+            cached = self._cached_classification(cache_key)
+            if cached is not None:
+                results[index] = cached
+                continue
+
+            # Start a new request when the current one is full
+            size = len(email_data['subject']) + len(email_data['sender']) + len(email_data['body'])
+            if (not chunks or len(chunks[-1]) >= BATCH_CLASSIFY_SIZE
+                    or chunk_chars + size > BATCH_CLASSIFY_MAX_CHARS):
+                chunks.append([])
+                chunk_chars = 0
+            chunks[-1].append((index, cache_key))
+            chunk_chars += size
+
+        def classify_chunk(chunk: List[Tuple[int, bytes]]) -> List[Dict[str, Any]]:
+            if len(chunk) == 1:
+                return [self.classify_email(emails[chunk[0][0]])]
+            return self._classify_chunk([emails[index] for index, _ in chunk], [key for _, key in chunk])
+
+        # The calls are network-bound; the shared rate limiter still paces them
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_CLASSIFICATIONS, len(chunks)))) as executor:
+            for chunk, classifications in zip(chunks, executor.map(classify_chunk, chunks)):
+                for (index, _), classification in zip(chunk, classifications):
+                    results[index] = classification
+        return results
+
+    def _classify_chunk(self, emails: List[Dict[str, Any]], cache_keys: List[bytes]) -> List[Dict[str, Any]]:
+        """Classify several emails in one OpenAI request, classifying singly any it fails to answer"""
+        try:
+            prompt = f"""
+            The following JSON array holds several emails, each with an id, subject, sender and body:
+            {json.dumps([
+                {'id': index, 'subject': email_data['subject'], 'sender': email_data['sender'],
+                 'body': email_data['body']}
+                for index, email_data in enumerate(emails)
+            ])}
+            
+            Analyze each email independently and respond with a JSON object of the form
+            {{"results": [...]}} holding one entry per email. Every entry carries the email's "id"
+            plus the following structure:
+            {CLASSIFICATION_FORMAT}
+            """
+
+            response = create_chat_completion(
+                self.client,
+                model="gpt-3.5-turbo",
+                messages=[
+                    {"role": "system", "content": self._system_prompt},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format={"type": "json_object"}
+            )
+            items = json.loads(response.choices[0].message.content).get('results', [])
+            by_id = {str(item.pop('id', None)): item for item in items if isinstance(item, dict)}
+            self.logger.info(f"Batched classification completed for {len(by_id)} of {len(emails)} emails")
+        except Exception as e:
+            self.logger.error(f"Error in batched email classification: {str(e)}")
+            by_id = {}
+
+        classifications = []
+        for index, (email_data, cache_key) in enumerate(zip(emails, cache_keys)):
+            result = by_id.get(str(index))
+            if result is None:
+                classifications.append(self.classify_email(email_data))
+            else:
+                classifications.append(self._store_classification(cache_key, result))
+        return classifications
+
     def get_target_emails(self, classification: Dict[str, Any], sender_email: str = None) -> List[Dict[str, Any]]:
         """Get target email addresses based on classification and sender email"""
-        targets = []
-        
-        # Get enabled categories
-        enabled_categories = {
-            cat: conf for cat, conf in self.config.EMAIL_CATEGORIES.items() 
-            if conf.get('enabled', True)
-        }
-        
         # First check for direct forwarding based on sender email
         if sender_email:
-            sender_email = sender_email.lower()
-            for category, config in enabled_categories.items():
-                if (config.get('direct_forward', False) and 
-                    any(sender_email.endswith(from_email.lower()) 
-                        for from_email in config.get('from_emails', []))):
-                    # Direct forward match found
-                    return [{'email': email, 'priority': 'high'} 
-                            for email in config.get('target_emails', [])]
-        
+            direct_targets = self._direct_targets_for(sender_email.lower())
+            if direct_targets is not None:
+                return [{'email': email, 'priority': 'high'} for email in direct_targets]
+
         # If no direct forward match, process based on categories
-        for category in classification.get('categories', []):
-            if category in enabled_categories:
-                cat_config = enabled_categories[category]
-                # Skip if this category requires direct forwarding only
-                if cat_config.get('direct_forward', False):
-                    continue
-                # Add target emails for this category
-                target_emails = cat_config.get('target_emails', [])
-                for email in target_emails:
-                    targets.append({
-                        'email': email,
-                        'priority': classification.get('priority', 'normal')
-                    })
-        
+        priority = classification.get('priority', 'normal')
+        return [
+            {'email': email, 'priority': priority}
+            for email in self._category_targets_for(tuple(classification.get('categories', [])))
+        ]
+
+    def _enabled_categories(self) -> Dict[str, Dict[str, Any]]:
+        """Get the configuration of enabled categories"""
+        return {
+            cat: conf for cat, conf in self.config.EMAIL_CATEGORIES.items()
+            if conf.get('enabled', True)
+        }
+
+    def _resolve_direct_targets(self, sender_email: str) -> Optional[Tuple[str, ...]]:
+        """Get the direct forwarding targets for a lowercased sender, or None when no rule matches"""
+        for config in self._enabled_categories().values():
+            if (config.get('direct_forward', False) and
+                any(sender_email.endswith(from_email.lower())
+                    for from_email in config.get('from_emails', []))):
+                return tuple(config.get('target_emails', []))
+        return None
+
+    def _resolve_category_targets(self, categories: Tuple[str, ...]) -> Tuple[str, ...]:
+        """Get the unique target emails of the given categories, in order"""
+        enabled_categories = self._enabled_categories()
+        targets = []
+        for category in categories:
+            cat_config = enabled_categories.get(category)
+            # Skip unknown categories and those that require direct forwarding only
+            if cat_config is None or cat_config.get('direct_forward', False):
+                continue
+            targets.extend(cat_config.get('target_emails', []))
+
         # Remove duplicates while preserving order
-        seen = set()
-        unique_targets = []
-        for target in targets:
-            if target['email'] not in seen:
-                seen.add(target['email'])
-                unique_targets.append(target)
-        
-        return unique_targets
+        return tuple(dict.fromkeys(targets))
 
     def should_mark_important(self, classification: Dict[str, Any]) -> bool:
         """Determine if email should be marked as important"""
@@ -198,3 +332,8 @@ For alerts vs notifications:
             'critical' in classification['categories'] or
             classification['alert']
         )
+
+@functools.lru_cache(maxsize=1)
+def get_classifier() -> EmailClassifier:
+    """Return a process-wide EmailClassifier using the environment config, created on first use."""
+    return EmailClassifier()
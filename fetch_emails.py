@@ -1,8 +1,9 @@
-from gmail_handler import GmailHandler
+from gmail_handler import GmailHandler, _extract_headers, _truncate
 import json
 from datetime import datetime
 from dotenv import load_dotenv
 import os
+import sys
 import base64
 
 # Load environment variables from .env file
@@ -31,6 +32,8 @@ def main():
         
         messages = results.get('messages', [])
         emails = []
+        # Collect per-message output and write it once after the loop
+        log_lines = []
         
         for message in messages:
             try:
@@ -42,10 +45,10 @@ def main():
                 ).execute()
                 
                 # Extract headers
-                headers = msg['payload']['headers']
-                subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                date = next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown')
+                headers = _extract_headers(msg['payload'])
+                subject = headers.get('subject', 'No Subject')
+                sender = headers.get('from', 'Unknown')
+                date = headers.get('date', 'Unknown')
                 
                 # Extract body
                 body = 'No body'
@@ -64,24 +67,30 @@ def main():
                     'subject': subject,
                     'from': sender,
                     'date': date,
-                    'body': body[:500] + '...' if len(body) > 500 else body  # Truncate long bodies
+                    'body': _truncate(body)
                 }
                 
                 emails.append(email_data)
                 
-                # Print email details
-                print("\n" + "="*80)
-                print(f"From: {sender}")
-                print(f"Subject: {subject}")
-                print(f"Date: {date}")
-                print("-"*80)
-                print(f"Body: {body[:200]}..." if len(body) > 200 else f"Body: {body}")
-                print("="*80)
+                # Collect email details
+                log_lines.extend([
+                    "\n" + "="*80,
+                    f"From: {sender}",
+                    f"Subject: {subject}",
+                    f"Date: {date}",
+                    "-"*80,
+                    f"Body: {_truncate(body, 200)}",
+                    "="*80
+                ])
                 
             except Exception as e:
-                print(f"Error processing message {message['id']}: {str(e)}")
+                log_lines.append(f"Error processing message {message['id']}: {str(e)}")
                 continue
         
+        if log_lines:
+            sys.stdout.write("\n".join(log_lines) + "\n")
+            sys.stdout.flush()
+        
         # Save emails to a JSON file
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         output_file = f"emails_{timestamp}.json"
@@ -1,75 +1,172 @@
 import os
-import pickle
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google.oauth2 import service_account
+import ast
+import functools
+import tempfile
 import logging
 import json
+import threading
+import requests
 from flask import session
 import os
 
+try:
+    import orjson
+except ImportError:  # optional speedup, fall back to the stdlib json module
+    orjson = None
+
 # Allow HTTP for local development
 os.environ['OAUTHLIB_INSECURE_TRANSPORT'] = '1'
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Google auth/API client libraries, imported on first use by _lazy_imports()
+Flow = None
+Request = None
+Credentials = None
+build = None
+
+def _lazy_imports():
+    """Import the heavy Google libraries the first time an authenticator is created"""
+    global Flow, Request, Credentials, build
+    if Flow is not None:
+        return
+    from google_auth_oauthlib.flow import Flow
+    from google.auth.transport.requests import Request
+    from google.oauth2.credentials import Credentials
+    from googleapiclient.discovery import build
+
+# Maximum number of in-flight OAuth states whose requested scopes are remembered
+MAX_PENDING_OAUTH_STATES = 100
+
+# Shared HTTP session so calls to Google endpoints reuse pooled keep-alive connections
+_HTTP = requests.Session()
+
+# Parsed credentials.json, shared by all authenticators
+_CLIENT_CONFIG = None
+_CLIENT_CONFIG_LOCK = threading.Lock()
+
+def _load_client_config():
+    """Load and parse credentials.json once per process"""
+    global _CLIENT_CONFIG
+    with _CLIENT_CONFIG_LOCK:
+        if _CLIENT_CONFIG is None:
+            if not os.path.exists('credentials.json'):
+                logger.error("credentials.json not found")
+                raise FileNotFoundError("OAuth client configuration file not found")
+            with open('credentials.json', 'rb') as f:
+                _CLIENT_CONFIG = _json_loads(f.read())
+        return _CLIENT_CONFIG
+
+def _json_loads(data):
+    """Parse JSON with orjson when available"""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _json_dumps(obj) -> bytes:
+    """Serialize JSON to bytes with orjson when available"""
+    return orjson.dumps(obj) if orjson else json.dumps(obj).encode('utf-8')
+
+def parse_token_data(creds_info):
+    """Parse token.json contents, returning (data, is_legacy_format)"""
+    try:
+        return _json_loads(creds_info), False
+    except json.JSONDecodeError:
+        # Older token files were written as a Python dict repr
+        return ast.literal_eval(creds_info), True
+
+# Serializes token.json parsing so concurrent requests share one parse
+_CREDS_LOCK = threading.Lock()
+
+@functools.lru_cache(maxsize=8)
+def _creds_for(scopes_key, mtime):
+    """
+    Parse token.json into Credentials, shared by all authenticators.
+    Cached per scope set and file mtime; returns (creds, legacy_token_data or None).
+    """
+    with open('token.json', 'r') as token:
+        creds_info = token.read()
+    logger.info("Found existing token.json")
+    logger.debug("Token info: %s", creds_info)
+    token_data, is_legacy = parse_token_data(creds_info)
+    creds = Credentials.from_authorized_user_info(token_data, sorted(scopes_key))
+    return creds, (token_data if is_legacy else None)
+
 class GmailAuthenticator:
     """Handles Gmail API authentication using OAuth2"""
 
     def __init__(self, scopes):
+        _lazy_imports()
         self.scopes = scopes
         self.logger = logger
         self._setup_oauth_config()
+        # Order-independent scope identity, compared against the scopes stored per OAuth state
+        self._scope_key = tuple(sorted(self.scopes))
+        # Last credentials handed out by get_credentials, reused while still valid
+        self._valid_creds = None
         self._flow = None
+        # Requested scopes per pending OAuth state; only the state goes in the session cookie
+        self._scopes_by_state = {}
+        # Gmail service and profile email, reused while the credentials are unchanged
+        self._service = None
+        self._service_token = None
+        self._user_email = None
+        self._user_email_key = None
 
     def _setup_oauth_config(self):
         """Setup OAuth configuration"""
         # Load the client configuration
-        if os.path.exists('credentials.json'):
-            with open('credentials.json', 'r') as f:
-                self.client_config = json.load(f)
-                # Remove metadata scope if present as it conflicts with full access
-                if isinstance(self.scopes, list):
-                    self.scopes = [scope for scope in self.scopes 
-                                 if 'gmail.metadata' not in scope]
-                self.logger.info("Loaded OAuth client configuration")
-                self.logger.debug(f"Client config: {self.client_config}")
-        else:
-            self.logger.error("credentials.json not found")
-            raise FileNotFoundError("OAuth client configuration file not found")
+        self.client_config = _load_client_config()
+        # Remove metadata scope if present as it conflicts with full access
+        if isinstance(self.scopes, list):
+            if any('gmail.metadata' in scope for scope in self.scopes):
+                self.scopes = [scope for scope in self.scopes 
+                             if 'gmail.metadata' not in scope]
+            # Scopes do not change after setup
+            self.scopes = tuple(self.scopes)
+        self.logger.info("Loaded OAuth client configuration")
+        self.logger.debug("Client config: %s", self.client_config)
 
     def _get_redirect_uri(self):
         """Get the correct redirect URI from client configuration"""
         redirect_uri = os.environ.get("OAUTH_CALLBACK_URL")
         if not redirect_uri:
             raise ValueError("OAUTH_CALLBACK_URL environment variable is required")
-        self.logger.debug(f"Using redirect URI: {redirect_uri}")
+        self.logger.debug("Using redirect URI: %s", redirect_uri)
         return redirect_uri
 
-    def get_authorization_url(self):
-        """Get the authorization URL to start OAuth flow"""
-        try:
+    def _get_flow(self):
+        """Get the OAuth flow, creating it on first use and reusing it afterwards"""
+        if self._flow is None:
             self.logger.debug("Creating OAuth flow")
             self._flow = Flow.from_client_config(
                 self.client_config,
                 scopes=self.scopes,
                 redirect_uri=self._get_redirect_uri()
             )
+        return self._flow
+
+    def get_authorization_url(self):
+        """Get the authorization URL to start OAuth flow"""
+        try:
+            flow = self._get_flow()
+            # Generate a fresh PKCE code verifier for each authorization attempt
+            flow.code_verifier = None
             
             self.logger.debug("Generating authorization URL")
-            auth_url, state = self._flow.authorization_url(
+            auth_url, state = flow.authorization_url(
                 access_type='offline',
                 include_granted_scopes='false',  # Don't include previously granted scopes
                 prompt='consent'  # Force consent screen to get refresh token
             )
             
-            # Store the state and scopes in the session
+            # Store the state in the session and remember the scopes for this state
             session['oauth_state'] = state
-            session['oauth_scopes'] = self.scopes
-            self.logger.debug(f"Stored state in session: {state}")
-            self.logger.debug(f"Stored scopes in session: {self.scopes}")
+            if len(self._scopes_by_state) >= MAX_PENDING_OAUTH_STATES:
+                # Drop the oldest abandoned authorization attempt
+                self._scopes_by_state.pop(next(iter(self._scopes_by_state)))
+            self._scopes_by_state[state] = self._scope_key
+            self.logger.debug("Stored state in session: %s", state)
+            self.logger.debug("Stored scopes for state: %s", self.scopes)
             
             return auth_url
         except Exception as e:
@@ -79,21 +176,56 @@ class GmailAuthenticator:
     def _load_credentials_from_token(self):
         """Load credentials from token file if it exists."""
         try:
-            if os.path.exists('token.json'):
-                with open('token.json', 'r') as token:
-                    creds_info = token.read()
-                    self.logger.info("Found existing token.json")
-                    self.logger.debug(f"Token info: {creds_info}")
-                    return Credentials.from_authorized_user_info(eval(creds_info), self.scopes)
-            else:
+            try:
+                mtime = os.stat('token.json').st_mtime
+            except FileNotFoundError:
                 self.logger.debug("No token.json found")
+                return None
+
+            with _CREDS_LOCK:
+                creds, legacy_data = _creds_for(frozenset(self.scopes), mtime)
+                if legacy_data is not None:
+                    # Rewriting changes the mtime, so this cache entry is never hit again
+                    self._write_token(legacy_data)
+                    self.logger.info("Migrated token.json to JSON format")
+            return creds
         except Exception as e:
             self.logger.error(f"Error loading token.json: {str(e)}")
-            if os.path.exists('token.json'):
-                os.remove('token.json')
-                self.logger.info("Removed invalid token.json")
+            self._remove_token("Removed invalid token.json")
         return None
 
+    def _remove_token(self, message="Removed token.json file"):
+        """Remove the token file if present and drop cached credentials."""
+        try:
+            os.remove('token.json')
+            self.logger.info(message)
+        except FileNotFoundError:
+            pass
+        self._invalidate_credentials_cache()
+
+    def _invalidate_credentials_cache(self):
+        """Drop the cached credentials so the next load re-reads token.json."""
+        _creds_for.cache_clear()
+        self._valid_creds = None
+
+    def _write_token(self, creds_data):
+        """Write credentials data to token file as JSON."""
+        # Write to a temp file and swap it in so a crash never leaves a truncated token.json
+        fd, tmp_path = tempfile.mkstemp(dir='.', prefix='token.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as token:
+                token.write(_json_dumps(creds_data))
+                token.flush()
+                os.fsync(token.fileno())
+            os.replace(tmp_path, 'token.json')
+        except Exception:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._invalidate_credentials_cache()
+
     def _save_credentials(self, creds):
         """Save credentials to token file."""
         try:
@@ -105,8 +237,7 @@ class GmailAuthenticator:
                 'client_secret': creds.client_secret,
                 'scopes': creds.scopes,
             }
-            with open('token.json', 'w') as token:
-                token.write(str(creds_data))
+            self._write_token(creds_data)
             self.logger.info("Saved credentials to token.json")
         except Exception as e:
             self.logger.error(f"Error saving credentials: {str(e)}")
@@ -114,6 +245,10 @@ class GmailAuthenticator:
 
     def get_credentials(self):
         """Get valid user credentials from storage or initiate OAuth2 flow."""
+        # Skip the token file entirely while the last credentials are still valid
+        if self._valid_creds is not None and self._valid_creds.valid:
+            return self._valid_creds
+
         creds = self._load_credentials_from_token()
 
         if not creds or not creds.valid:
@@ -142,21 +277,22 @@ class GmailAuthenticator:
                     self.logger.error(f"Error in OAuth2 flow: {str(e)}")
                     raise
 
+        if creds and creds.valid:
+            self._valid_creds = creds
         return creds
 
     def handle_oauth2_callback(self, request_url: str, state: str = None):
         """Handle OAuth2 callback and save credentials"""
         try:
-            self.logger.debug(f"Handling OAuth callback with state: {state}")
-            self.logger.debug(f"Session state: {session.get('oauth_state')}")
+            self.logger.debug("Handling OAuth callback with state: %s", state)
+            self.logger.debug("Session state: %s", session.get('oauth_state'))
             
             # Ensure scopes match
-            if 'oauth_scopes' in session:
-                original_scopes = set(session['oauth_scopes'])
-                current_scopes = set(self.scopes)
-                if original_scopes != current_scopes:
-                    self.logger.warning("Scopes have changed during authentication")
-                    self.scopes = list(original_scopes)  # Use original scopes
+            requested_key = self._scopes_by_state.pop(session.get('oauth_state'), None)
+            if requested_key is not None and requested_key != self._scope_key:
+                self.logger.warning("Scopes have changed during authentication")
+                self.scopes = requested_key  # Use original scopes
+                self._scope_key = requested_key
             
             # Fetch the token
             self._flow.fetch_token(authorization_response=request_url)
@@ -174,8 +310,7 @@ class GmailAuthenticator:
                 'scopes': self.scopes  # Use our scopes instead of creds.scopes
             }
             
-            with open('token.json', 'w') as token:
-                token.write(str(creds_data))
+            self._write_token(creds_data)
             self.logger.info("Saved credentials to token.json")
             
             return creds
@@ -191,22 +326,16 @@ class GmailAuthenticator:
             creds = self._load_credentials_from_token()
             if creds:
                 # Revoke access
-                import google.oauth2.credentials
-                import google.auth.transport.requests
-                import requests
-                
                 # Build the revoke request
                 revoke_url = "https://accounts.google.com/o/oauth2/revoke"
                 params = {'token': creds.token}
                 headers = {'content-type': 'application/x-www-form-urlencoded'}
                 
                 # Make the request
-                response = requests.post(revoke_url, params=params, headers=headers)
+                response = _HTTP.post(revoke_url, data=params, headers=headers, timeout=5)
                 
                 # Remove the token file regardless of the response
-                if os.path.exists('token.json'):
-                    os.remove('token.json')
-                    self.logger.info("Removed token.json file")
+                self._remove_token()
                 
                 if response.status_code == 200:
                     self.logger.info("Successfully revoked credentials")
@@ -222,9 +351,7 @@ class GmailAuthenticator:
         except Exception as e:
             self.logger.error(f"Error revoking credentials: {str(e)}")
             # Try to remove the token file anyway
-            if os.path.exists('token.json'):
-                os.remove('token.json')
-                self.logger.info("Removed token.json file")
+            self._remove_token()
             return False
 
     def get_user_email(self):
@@ -233,13 +360,20 @@ class GmailAuthenticator:
             creds = self._load_credentials_from_token()
             if not creds:
                 return None
+
+            # The address only changes when the user re-authorizes
+            if creds.refresh_token and self._user_email_key == creds.refresh_token:
+                return self._user_email
                 
-            from googleapiclient.discovery import build
-            service = build('gmail', 'v1', credentials=creds)
+            if self._service is None or self._service_token != creds.token:
+                self._service = build('gmail', 'v1', credentials=creds, cache_discovery=False, static_discovery=True)
+                self._service_token = creds.token
             
             # Get the user's profile
-            profile = service.users().getProfile(userId='me').execute()
-            return profile.get('emailAddress')
+            profile = self._service.users().getProfile(userId='me').execute()
+            self._user_email = profile.get('emailAddress')
+            self._user_email_key = creds.refresh_token
+            return self._user_email
             
         except Exception as e:
             self.logger.error(f"Error getting user email: {str(e)}")
@@ -1,16 +1,151 @@
-import base64
+import functools
+import io
 import os
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+import threading
+import email
+import email.policy
+import time
+from collections import OrderedDict
+from email import base64mime
+from email.generator import BytesGenerator
+from email.message import EmailMessage
 import logging
-from typing import Dict, List, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Any, Optional, Tuple
+import google_auth_httplib2
+import httplib2
 from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 from config import Config
 from gmail_auth import GmailAuthenticator
+from utils import (
+    GOOGLE_MAX_RETRY_DELAY, GOOGLE_RETRYABLE_STATUSES, backoff_delay, execute_google_request, is_retryable_error
+)
+
+try:
+    import pybase64 as base64
+except ImportError:  # optional speedup, fall back to the stdlib base64 module
+    import base64
+
+# Socket timeout in seconds for Gmail API connections
+HTTP_TIMEOUT = 30
+# HTTP statuses retried for messages.send: only rate limiting, since a send that hit a
+# server error may still have gone out (rate-limit 403s are retried as well)
+SEND_RETRYABLE_STATUSES = (429,)
+# Calls per batch request; Gmail accepts 100 but rate-limits large batches, so it recommends 50
+BATCH_SIZE = 50
+# Times a call that failed inside a batch with a retryable error is sent again in a later batch
+BATCH_ITEM_RETRIES = 3
+# Maximum number of batch requests in flight at once
+MAX_CONCURRENT_BATCHES = 4
+# Headers needed to list messages without downloading their bodies
+LIST_METADATA_HEADERS = ['Subject', 'From', 'Date', 'To', 'Cc']
+# Response projections for list views: only the parts of a message they read;
+# LIST_BODY_FIELDS covers everything _parse_message reads
+LIST_METADATA_FIELDS = 'id,threadId,payload/headers'
+LIST_BODY_FIELDS = 'id,threadId,payload(mimeType,headers,body,parts(mimeType,filename,body))'
+# Number of unprojected full-format messages kept in memory by get_message
+MESSAGE_CACHE_SIZE = 128
+# Number of body characters kept in list previews
+BODY_PREVIEW_LENGTH = 500
+
+# Lowercased header names used as _extract_headers keys
+_H_SUBJECT, _H_FROM, _H_DATE, _H_TO, _H_CC = 'subject', 'from', 'date', 'to', 'cc'
+# The only headers callers read; Received, DKIM-Signature, ARC-* and the like are dropped
+HEADERS_WANTED = frozenset((_H_SUBJECT, _H_FROM, _H_DATE, _H_TO, _H_CC))
+# Usual spellings of the wanted headers, resolved to their keys without lower()
+_HEADER_KEYS = {name: name.lower() for name in LIST_METADATA_HEADERS}
+_HEADER_KEYS.update((name, name) for name in HEADERS_WANTED)
+
+_thread_local = threading.local()
+
+def _thread_http() -> httplib2.Http:
+    """Per-thread httplib2.Http, so handlers on one thread reuse its open connections"""
+    # httplib2.Http is not thread-safe, so it is shared per thread rather than process-wide
+    http = getattr(_thread_local, 'http', None)
+    if http is None:
+        http = _thread_local.http = httplib2.Http(timeout=HTTP_TIMEOUT)
+    return http
+
+@functools.lru_cache(maxsize=1)
+def _gmail_discovery_doc() -> str:
+    """Gmail discovery document shipped with google-api-python-client, read from disk once"""
+    from googleapiclient import discovery_cache
+    # Kept as text: build_from_document mutates a parsed document, so every build parses its own copy
+    return discovery_cache.get_static_doc('gmail', 'v1')
+
+def _extract_headers(payload: Dict[str, Any]) -> Dict[str, str]:
+    """Map the lowercased names of the HEADERS_WANTED headers to their values"""
+    headers = {}
+    for h in payload.get('headers', []):
+        name = h['name']
+        key = _HEADER_KEYS.get(name)
+        if key is None:
+            # Unusual casing of a wanted header, or a header nobody reads
+            key = name.lower()
+            if key not in HEADERS_WANTED:
+                continue
+        headers[key] = h['value']
+    return headers
+
+# SMTP policy that refolds every header, so short values are RFC 2047-encoded and long ASCII ones folded too
+_HEADER_POLICY = email.policy.SMTP.clone(refold_source='all')
+
+def _fold_header(name: str, value: str) -> str:
+    """Render a 'Name: value' header line, RFC 2047-encoded and folded with CRLF as needed"""
+    # Newlines in the value are flattened first so they cannot inject further headers
+    return _HEADER_POLICY.fold(name, ' '.join(value.splitlines()))
+
+def _b64url_decode(data: str) -> bytes:
+    """Decode base64url data, restoring any padding the sender stripped"""
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+def _decode_body(data: str, max_chars: Optional[int] = None) -> str:
+    """Decode base64url body data, decoding only enough for max_chars characters when given"""
+    # Malformed UTF-8 is replaced rather than failing the whole body
+    if max_chars is None:
+        return _b64url_decode(data).decode('utf-8', errors='replace')
+    # UTF-8 uses at most 4 bytes per character; keep whole 4-char base64 groups for
+    # two characters beyond the limit so callers can still tell the text was cut
+    max_bytes = (max_chars + 2) * 4
+    encoded_len = -(-max_bytes // 3) * 4
+    if len(data) <= encoded_len:
+        return _b64url_decode(data).decode('utf-8', errors='replace')
+    # The cut may split the last character, so the partial tail is dropped
+    return base64.urlsafe_b64decode(data[:encoded_len]).decode('utf-8', errors='ignore')
+
+def _extract_all(payload: Dict[str, Any],
+                 max_chars: Optional[int] = None) -> Tuple[Dict[str, str], Optional[str], List[Dict[str, Any]]]:
+    """
+    Walk a full-format payload once, returning its headers, the first text/plain
+    body (None if there is none) and the metadata of its attachments.
+    With max_chars, only the start of the body is decoded.
+    """
+    body = None
+    attachments = []
+
+    for part in payload.get('parts', ()):
+        if part.get('filename'):
+            attachments.append({
+                'filename': part['filename'],
+                'attachment_id': part.get('body', {}).get('attachmentId'),
+                'mime_type': part.get('mimeType')
+            })
+        elif body is None and part.get('mimeType') == 'text/plain':
+            part_body = part.get('body', {})
+            if 'data' in part_body:
+                body = _decode_body(part_body['data'], max_chars)
+
+    if body is None:
+        payload_body = payload.get('body', {})
+        if 'data' in payload_body:
+            body = _decode_body(payload_body['data'], max_chars)
+
+    return _extract_headers(payload), body, attachments
+
+def _truncate(text: str, limit: int = BODY_PREVIEW_LENGTH) -> str:
+    """Shorten text to limit characters, marking the cut with an ellipsis"""
+    return text if len(text) <= limit else text[:limit] + '...'
 
 class GmailHandler:
     """Handles Gmail API operations"""
@@ -20,18 +155,27 @@ class GmailHandler:
         self.logger = logging.getLogger(__name__)
         self.config = config
         self.credentials = credentials  # Store credentials for other services to use
+        self._label_cache: Optional[Dict[str, str]] = None  # lowercased label name -> label ID
+        self._label_lock = threading.Lock()
+        self._message_cache: OrderedDict = OrderedDict()  # message ID -> full-format message
+        # Requests issued from other threads use connections of their own
+        self._owner_thread = threading.get_ident()
+        self._thread_state = threading.local()
         
+        # Deferred so importing this module (e.g. for LIST_BODY_FIELDS) skips the discovery machinery
+        from googleapiclient.discovery import build_from_document
+
         try:
-            self.service = build('gmail', 'v1', credentials=credentials)
+            # Keep-alive connections shared with other handlers created on this thread
+            self._http = google_auth_httplib2.AuthorizedHttp(credentials, http=_thread_http())
+            self.service = build_from_document(_gmail_discovery_doc(), http=self._http)
             self.logger.info("Initializing Gmail handler")
             
-            # Test authentication by getting user profile
-            user_info = self.service.users().getProfile(userId='me').execute()
-            self.email = user_info['emailAddress']
+            # Test authentication by getting user profile, which also carries the mailbox details
+            profile = self._exec_with_retry(self.service.users().getProfile(userId='me'))
+            self.email = profile['emailAddress']
             self.logger.info(f"Successfully authenticated as: {self.email}")
             
-            # Get mailbox details
-            profile = self.service.users().getProfile(userId='me').execute()
             if 'threadsTotal' in profile:
                 self.logger.info(f"Email thread size: {profile['threadsTotal']}")
             
@@ -54,7 +198,7 @@ class GmailHandler:
             return False
 
         try:
-            profile = self.service.users().getProfile(userId='me').execute()
+            profile = self._exec_with_retry(self.service.users().getProfile(userId='me'))
             self.logger.info(f"Successfully authenticated as: {profile['emailAddress']}")
             self.logger.info(f"Email thread size: {profile.get('threadsTotal', 0)}")
             self.logger.info(f"Storage used: {profile.get('storageUsed', 0)} bytes")
@@ -63,45 +207,47 @@ class GmailHandler:
             self.logger.error(f"Failed to verify Gmail connection: {str(e)}")
             return False
 
-    def fetch_emails(self, max_results: int = 10) -> List[Dict[str, Any]]:
-        """Fetch recent emails"""
+    def fetch_emails(self, max_results: int = 10, include_body: bool = False) -> List[Dict[str, Any]]:
+        """Fetch recent emails, with a body preview only when include_body is set"""
         try:
             self.logger.info(f"Fetching last {max_results} emails")
             
             # List messages
-            results = self.service.users().messages().list(
+            results = self._exec_with_retry(self.service.users().messages().list(
                 userId='me',
                 maxResults=max_results
-            ).execute()
+            ))
             
             messages = results.get('messages', [])
+            fetched = self._fetch_listed_messages(messages, include_body)
             emails = []
             
             for message in messages:
                 try:
-                    # Get full message details
-                    msg = self.service.users().messages().get(
-                        userId='me',
-                        id=message['id'],
-                        format='full'
-                    ).execute()
-                    
-                    # Extract headers
-                    headers = msg['payload']['headers']
-                    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                    date = next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown')
+                    msg = fetched.get(message['id'])
+                    if not msg:
+                        continue
                     
-                    # Extract body
-                    body = self._get_message_body(msg)
+                    # Extract headers, and the body in the same pass when it was fetched
+                    if include_body:
+                        headers, body, _ = self._parse_message(msg, max_chars=BODY_PREVIEW_LENGTH)
+                    else:
+                        headers = _extract_headers(msg['payload'])
+                    subject = headers.get(_H_SUBJECT, 'No Subject')
+                    sender = headers.get(_H_FROM, 'Unknown')
+                    date = headers.get(_H_DATE, 'Unknown')
                     
-                    emails.append({
+                    email_data = {
                         'id': message['id'],
                         'subject': subject,
                         'from': sender,
-                        'date': date,
-                        'body': body[:500] + '...' if len(body) > 500 else body  # Truncate long bodies
-                    })
+                        'date': date
+                    }
+                    
+                    if include_body:
+                        email_data['body'] = _truncate(body)
+                    
+                    emails.append(email_data)
                     
                 except Exception as e:
                     self.logger.error(f"Error processing message {message['id']}: {str(e)}")
@@ -113,38 +259,41 @@ class GmailHandler:
             self.logger.error(f"Failed to fetch emails: {str(e)}")
             return []
 
-    def get_unread_emails(self, max_results: int = 10) -> List[Dict[str, Any]]:
-        """Get unread emails with their details"""
+    def get_unread_emails(self, max_results: int = 10, include_body: bool = False) -> List[Dict[str, Any]]:
+        """Get unread emails with their details, including bodies only when include_body is set"""
         try:
             messages = self.list_messages(query='is:unread', max_results=max_results)
+            fetched = self._fetch_listed_messages(messages, include_body)
             emails = []
             
+            # Used to check whether the current user is in To/CC
+            user_email = (self.get_authenticated_email() or '').lower()
+            
             for message in messages:
                 try:
-                    msg = self.get_message(message['id'])
+                    msg = fetched.get(message['id'])
                     if msg:
-                        # Extract headers
-                        headers = msg['payload']['headers']
-                        subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                        sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                        to = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-                        cc = next((h['value'] for h in headers if h['name'].lower() == 'cc'), '')
-                        date = next((h['value'] for h in headers if h['name'].lower() == 'date'), 'Unknown')
-                        
-                        # Extract body
-                        body = self._get_message_body(msg)
+                        # Extract headers, and the body and attachments in the same pass when fetched
+                        if include_body:
+                            headers, body, attachments = self._parse_message(msg)
+                        else:
+                            headers = _extract_headers(msg['payload'])
+                        subject = headers.get(_H_SUBJECT, 'No Subject')
+                        sender = headers.get(_H_FROM, 'Unknown')
+                        to = headers.get(_H_TO, '')
+                        cc = headers.get(_H_CC, '')
+                        date = headers.get(_H_DATE, 'Unknown')
                         
                         # Check if current user is CC'd
-                        user_email = self.get_authenticated_email()
                         is_cced = False
+                        is_to = False
                         if user_email:
-                            cc_list = [addr.strip().lower() for addr in cc.split(',') if addr.strip()]
-                            to_list = [addr.strip().lower() for addr in to.split(',') if addr.strip()]
-                            user_email = user_email.lower()
-                            is_cced = user_email in cc_list
-                            is_to = user_email in to_list
+                            cc_addrs = {addr.strip().lower() for addr in cc.split(',') if addr.strip()}
+                            to_addrs = {addr.strip().lower() for addr in to.split(',') if addr.strip()}
+                            is_cced = user_email in cc_addrs
+                            is_to = user_email in to_addrs
                         
-                        emails.append({
+                        email_data = {
                             'id': message['id'],
                             'thread_id': message['threadId'],
                             'subject': subject,
@@ -152,10 +301,15 @@ class GmailHandler:
                             'to': to,
                             'cc': cc,
                             'date': date,
-                            'body': body,
                             'is_cced': is_cced,
                             'is_to': is_to
-                        })
+                        }
+                        
+                        if include_body:
+                            email_data['body'] = body
+                            email_data['attachments'] = attachments
+                        
+                        emails.append(email_data)
                         
                 except Exception as e:
                     self.logger.error(f"Error processing message {message['id']}: {str(e)}")
@@ -167,140 +321,341 @@ class GmailHandler:
             self.logger.error(f"Error getting unread emails: {str(e)}")
             return []
 
-    def _parse_email(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
-        """Parse email data into structured format"""
-        headers = email_data['payload']['headers']
-        subject = next(h['value'] for h in headers if h['name'].lower() == 'subject')
-        sender = next(h['value'] for h in headers if h['name'].lower() == 'from')
-
-        body = ""
-        attachments = []
-
-        if 'parts' in email_data['payload']:
-            for part in email_data['payload']['parts']:
-                if part.get('mimeType') == 'text/plain':
-                    body = base64.urlsafe_b64decode(
-                        part['body']['data']
-                    ).decode('utf-8')
-                elif 'filename' in part:
-                    attachments.append({
-                        'filename': part['filename'],
-                        'attachment_id': part['body'].get('attachmentId'),
-                        'mime_type': part['mimeType']
-                    })
+    @staticmethod
+    def _parse_email(email_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Parse email data into structured format; needs no handler state"""
+        headers, body, attachments = _extract_all(email_data['payload'])
+        subject = headers[_H_SUBJECT]
+        sender = headers[_H_FROM]
 
         return {
             'id': email_data['id'],
             'subject': subject,
             'sender': sender,
-            'body': body,
+            'body': body or "",
             'attachments': attachments
         }
 
     def download_attachment(self, email_id: str, attachment_id: str) -> Optional[bytes]:
         """Download email attachment"""
         try:
-            attachment = self.service.users().messages().attachments().get(
+            attachment = self._exec_with_retry(self.service.users().messages().attachments().get(
                 userId='me',
                 messageId=email_id,
                 id=attachment_id
-            ).execute()
+            ))
 
             if 'data' in attachment:
-                return base64.urlsafe_b64decode(attachment['data'])
+                return _b64url_decode(attachment['data'])
             return None
 
         except Exception as e:
             self.logger.error(f"Error downloading attachment: {str(e)}")
             return None
 
+    def download_attachments(self, email_id: str, attachment_ids: List[str]) -> Dict[str, Optional[bytes]]:
+        """Download several attachments of one email in batch requests, keyed by attachment ID"""
+        try:
+            responses = self._batch_execute(
+                attachment_ids,
+                lambda attachment_id: self.service.users().messages().attachments().get(
+                    userId='me',
+                    messageId=email_id,
+                    id=attachment_id
+                )
+            )
+            return {
+                attachment_id: _b64url_decode(responses[attachment_id]['data'])
+                if 'data' in responses.get(attachment_id, {}) else None
+                for attachment_id in attachment_ids
+            }
+
+        except Exception as e:
+            self.logger.error(f"Error downloading attachments: {str(e)}")
+            return {attachment_id: None for attachment_id in attachment_ids}
+
+    def download_attachments_bulk(self, requests: List[Tuple[str, str]]) -> List[Optional[bytes]]:
+        """Download attachments of any emails from (email ID, attachment ID) pairs, in input order"""
+        try:
+            # Attachment IDs are only unique per message, so batch entries are keyed by position
+            responses = self._batch_execute(
+                [str(index) for index in range(len(requests))],
+                lambda index: self.service.users().messages().attachments().get(
+                    userId='me',
+                    messageId=requests[int(index)][0],
+                    id=requests[int(index)][1]
+                )
+            )
+            return [
+                _b64url_decode(responses[str(index)]['data'])
+                if 'data' in responses.get(str(index), {}) else None
+                for index in range(len(requests))
+            ]
+
+        except Exception as e:
+            self.logger.error(f"Error downloading attachments: {str(e)}")
+            return [None] * len(requests)
+
     def forward_email(self, to_email: str, subject: str, body: str, attachments: List[Dict[str, Any]] = None, cc_list: List[str] = None) -> bool:
         """Forward an email to specified address with optional CC recipients"""
         try:
-            # Create forwarding message
-            message = MIMEMultipart()
-            message['to'] = to_email
-            message['subject'] = subject
-            
-            # Add CC recipients if provided
-            if cc_list:
-                message['cc'] = ', '.join(cc_list)
-            
-            # Add the message body
-            message.attach(MIMEText(body, 'plain'))
+            message = self._new_forward(to_email, subject, body, cc_list)
             
             # Add attachments if any
             if attachments:
                 for attachment in attachments:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment['content'])
-                    encoders.encode_base64(part)
-                    part.add_header(
-                        'Content-Disposition',
-                        f'attachment; filename="{attachment["filename"]}"'
+                    message.add_attachment(
+                        attachment['content'],
+                        maintype='application',
+                        subtype='octet-stream',
+                        filename=attachment['filename']
                     )
-                    message.attach(part)
-            
-            # Encode and send
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
-            self.service.users().messages().send(
-                userId='me',
-                body={'raw': raw}
-            ).execute()
             
-            self.logger.info(f"Successfully forwarded message to {to_email}")
-            if cc_list:
-                self.logger.info(f"CC'd to: {', '.join(cc_list)}")
-            return True
+            return self._send_forward(message, to_email, cc_list)
             
         except Exception as e:
             self.logger.error(f"Error forwarding message: {str(e)}")
             return False
 
-    def _get_message_body(self, message_data: Dict[str, Any]) -> str:
-        """Extract message body from message data"""
+    def forward_emails(self, forwards: List[Dict[str, Any]]) -> List[bool]:
+        """Send several forwards in batch requests; each entry holds forward_email's keyword arguments"""
         try:
-            # Extract headers for fallback
-            headers = message_data['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), '')
-            
-            # Try to get body from parts
-            if 'parts' in message_data['payload']:
-                parts = message_data['payload']['parts']
-                for part in parts:
-                    if part.get('mimeType') == 'text/plain':
-                        if 'data' in part.get('body', {}):
-                            return base64.urlsafe_b64decode(part['body']['data']).decode('utf-8')
-            
-            # Try to get body directly
-            if 'body' in message_data['payload'] and 'data' in message_data['payload']['body']:
-                return base64.urlsafe_b64decode(message_data['payload']['body']['data']).decode('utf-8')
-            
-            # Fallback to subject if no body found
-            return f"Subject: {subject}"
-            
+            raws = {}
+            for index, forward in enumerate(forwards):
+                try:
+                    message = self._new_forward(forward['to_email'], forward['subject'],
+                                                forward['body'], forward.get('cc_list'))
+                    for attachment in forward.get('attachments') or []:
+                        message.add_attachment(
+                            attachment['content'],
+                            maintype='application',
+                            subtype='octet-stream',
+                            filename=attachment['filename']
+                        )
+                    raws[str(index)] = self._encode_raw(message)
+                except Exception as e:
+                    self.logger.error(f"Error creating forward to {forward.get('to_email')}: {str(e)}")
+
+            sent = self._batch_execute(list(raws), lambda request_id: self.service.users().messages().send(
+                userId='me',
+                body={'raw': raws[request_id]}
+            ), idempotent=False)
+            self.logger.info(f"Forwarded {len(sent)} of {len(forwards)} messages")
+            return [str(index) in sent for index in range(len(forwards))]
+        except Exception as e:
+            self.logger.error(f"Error forwarding messages: {str(e)}")
+            return [False] * len(forwards)
+
+    def forward_message(self, msg_id: str, to_email: str, subject: str, body: str, cc_list: List[str] = None) -> bool:
+        """Forward a stored message as a message/rfc822 attachment, carrying all its attachments"""
+        try:
+            # One raw download replaces fetching every attachment separately
+            original = self._exec_with_retry(self.service.users().messages().get(
+                userId='me',
+                id=msg_id,
+                format='raw',
+                fields='raw'
+            ))
+            message = self._new_forward(to_email, subject, body, cc_list)
+            message.add_attachment(email.message_from_bytes(_b64url_decode(original['raw']), policy=email.policy.default))
+            return self._send_forward(message, to_email, cc_list)
+
+        except Exception as e:
+            self.logger.error(f"Error forwarding message {msg_id}: {str(e)}")
+            return False
+
+    @staticmethod
+    def _new_forward(to_email: str, subject: str, body: str, cc_list: Optional[List[str]]) -> EmailMessage:
+        """Create a forwarding message with its text body"""
+        message = EmailMessage()
+        message['To'] = to_email
+        message['Subject'] = subject
+        
+        # Add CC recipients if provided
+        if cc_list:
+            message['Cc'] = ', '.join(cc_list)
+        
+        # Add the message body
+        message.set_content(body)
+        return message
+
+    @staticmethod
+    def _encode_raw(message: EmailMessage) -> str:
+        """Encode a message for the raw field of messages.send"""
+        # Serialize straight into a buffer and encode from it without an extra bytes copy;
+        # the buffer is released before the send so it is not held during the request
+        with io.BytesIO() as buffer:
+            BytesGenerator(buffer, mangle_from_=False).flatten(message)
+            with buffer.getbuffer() as view:
+                return base64.urlsafe_b64encode(view).decode('ascii')
+
+    def _send_forward(self, message: EmailMessage, to_email: str, cc_list: Optional[List[str]]) -> bool:
+        """Send a forwarding message"""
+        self._exec_with_retry(self.service.users().messages().send(
+            userId='me',
+            body={'raw': self._encode_raw(message)}
+        ), statuses=SEND_RETRYABLE_STATUSES)
+        
+        self.logger.info(f"Successfully forwarded message to {to_email}")
+        if cc_list:
+            self.logger.info(f"CC'd to: {', '.join(cc_list)}")
+        return True
+
+    def _parse_message(self, message_data: Dict[str, Any],
+                       max_chars: Optional[int] = None) -> Tuple[Dict[str, str], str, List[Dict[str, Any]]]:
+        """Extract headers, body text and attachment metadata from a full-format message"""
+        payload = message_data['payload']
+        try:
+            headers, body, attachments = _extract_all(payload, max_chars)
         except Exception as e:
             self.logger.error(f"Error extracting message body: {str(e)}")
-            return "Error extracting message body"
+            return _extract_headers(payload), "Error extracting message body", []
+
+        # Fallback to subject if no body found
+        if body is None:
+            body = f"Subject: {headers.get(_H_SUBJECT, '')}"
+        return headers, body, attachments
 
-    def get_message(self, msg_id: str) -> Optional[Dict[str, Any]]:
-        """Get message details by ID"""
+    def _get_message_body(self, message_data: Dict[str, Any], max_chars: Optional[int] = None) -> str:
+        """Extract message body from message data, decoding at most about max_chars when given"""
+        return self._parse_message(message_data, max_chars)[1]
+
+    def get_message(self, msg_id: str, format: str = 'full',
+                    metadata_headers: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Get message details by ID; only full-format messages are cached"""
         try:
-            self.logger.info(f"Fetching message: {msg_id}")
-            message = self.service.users().messages().get(
+            if format == 'full':
+                message = self._message_cache.get(msg_id)
+                if message is not None:
+                    self._message_cache.move_to_end(msg_id)
+                    return message
+            
+            self.logger.info("Fetching message: %s", msg_id)
+            message = self._exec_with_retry(self.service.users().messages().get(
                 userId='me',
                 id=msg_id,
-                format='full'
-            ).execute()
+                format=format,
+                metadataHeaders=metadata_headers
+            ))
+            if format == 'full':
+                self._cache_message(msg_id, message)
             return message
         except Exception as e:
             self.logger.error(f"Error getting message {msg_id}: {str(e)}")
             return None
 
+    def _exec_with_retry(self, request: Any, retries: int = 5,
+                         statuses: tuple = GOOGLE_RETRYABLE_STATUSES, **kwargs) -> Any:
+        """Execute a Gmail API request, retrying rate-limit errors and the given statuses with backoff"""
+        if kwargs.get('http') is None:
+            kwargs['http'] = self._http_for_thread()
+        return execute_google_request(request, retries, statuses, **kwargs)
+
+    def _http_for_thread(self):
+        """Authorized HTTP client for the calling thread; None means the service's own"""
+        if threading.get_ident() == self._owner_thread:
+            return None
+        http = getattr(self._thread_state, 'http', None)
+        if http is None:
+            http = self._thread_state.http = self._new_authorized_http()
+        return http
+
+    def _new_authorized_http(self):
+        """Create an authorized HTTP client with fresh connections, for use on a worker thread"""
+        return google_auth_httplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=HTTP_TIMEOUT))
+
+    def _fetch_listed_messages(self, messages: List[Dict[str, Any]], include_body: bool) -> Dict[str, Dict[str, Any]]:
+        """Fetch listed messages in full, or only their list headers when bodies are not needed"""
+        ids = [message['id'] for message in messages]
+        if include_body:
+            return self._batch_get_messages(ids, fields=LIST_BODY_FIELDS)
+        return self._batch_get_messages(ids, format='metadata', metadata_headers=LIST_METADATA_HEADERS,
+                                        fields=LIST_METADATA_FIELDS)
+
+    def _batch_execute(self, ids: List[str], make_request: Callable[[str], Any],
+                       idempotent: bool = True) -> Dict[str, Any]:
+        """
+        Run make_request(id) for every ID in batch requests, returning responses keyed by ID.
+        Idempotent calls that fail inside a batch with a retryable error are sent again in a later batch;
+        batches of other calls are only retried when rate-limited, as a server error may follow
+        some of their calls having gone through.
+        """
+        results = {}
+        statuses = GOOGLE_RETRYABLE_STATUSES if idempotent else SEND_RETRYABLE_STATUSES
+
+        def _execute(chunk, http=None):
+            pending = chunk
+            for attempt in range(BATCH_ITEM_RETRIES + 1):
+                failed = []
+
+                def _collect(request_id, response, exception):
+                    if exception is None:
+                        results[request_id] = response
+                    elif (idempotent and attempt < BATCH_ITEM_RETRIES and isinstance(exception, HttpError)
+                          and is_retryable_error(exception)):
+                        failed.append(request_id)
+                    else:
+                        self.logger.error(f"Error in batch request {request_id}: {str(exception)}")
+
+                batch = self.service.new_batch_http_request(callback=_collect)
+                for request_id in pending:
+                    batch.add(make_request(request_id), request_id=request_id)
+                self._exec_with_retry(batch, statuses=statuses, http=http)
+                if not failed:
+                    return
+
+                delay = backoff_delay(attempt, cap=GOOGLE_MAX_RETRY_DELAY)
+                self.logger.warning(f"Retrying {len(failed)} failed batch requests in {delay:.1f}s")
+                time.sleep(delay)
+                pending = failed
+
+        chunks = [ids[start:start + BATCH_SIZE] for start in range(0, len(ids), BATCH_SIZE)]
+        if len(chunks) <= 1:
+            for chunk in chunks:
+                _execute(chunk)
+        else:
+            # httplib2 is not thread-safe, so every concurrent batch gets its own connection
+            with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_BATCHES, len(chunks))) as executor:
+                futures = [
+                    executor.submit(_execute, chunk, self._new_authorized_http())
+                    for chunk in chunks
+                ]
+                for future in futures:
+                    future.result()
+
+        return results
+
+    def _batch_get_messages(self, ids: List[str], format: str = 'full',
+                            metadata_headers: Optional[List[str]] = None,
+                            fields: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Fetch messages in batch requests, returning them keyed by message ID"""
+        return self._batch_execute(ids, lambda msg_id: self.service.users().messages().get(
+            userId='me',
+            id=msg_id,
+            format=format,
+            metadataHeaders=metadata_headers,
+            fields=fields
+        ))
+
+    def get_messages(self, msg_ids: List[str], fields: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Get several full-format messages in batch requests, keyed by message ID"""
+        try:
+            return self._batch_get_messages(msg_ids, fields=fields)
+        except Exception as e:
+            self.logger.error(f"Error getting messages: {str(e)}")
+            return {}
+
+    def _cache_message(self, msg_id: str, message: Dict[str, Any]):
+        """Remember a full-format message, evicting the least recently used one when full"""
+        self._message_cache[msg_id] = message
+        self._message_cache.move_to_end(msg_id)
+        if len(self._message_cache) > MESSAGE_CACHE_SIZE:
+            self._message_cache.popitem(last=False)
+
     def list_messages(self, query: str = None, max_results: int = 10) -> List[Dict[str, Any]]:
         """List messages matching the specified query"""
         try:
-            self.logger.info(f"Listing messages with query: {query}")
+            self.logger.info("Listing messages with query: %s", query)
             
             # Create the list request
             request = self.service.users().messages().list(
@@ -310,10 +665,10 @@ class GmailHandler:
             )
             
             # Execute the request
-            response = request.execute()
+            response = self._exec_with_retry(request)
             messages = response.get('messages', [])
             
-            self.logger.info(f"Found {len(messages)} messages")
+            self.logger.info("Found %d messages", len(messages))
             return messages
             
         except Exception as e:
@@ -324,66 +679,128 @@ class GmailHandler:
         """Get the email address of the authenticated user"""
         return self.email
 
+    def get_history_id(self) -> Optional[str]:
+        """Get the mailbox's current history ID, the starting point for has_new_messages"""
+        try:
+            profile = self._exec_with_retry(self.service.users().getProfile(userId='me', fields='historyId'))
+            return profile['historyId']
+        except Exception as e:
+            self.logger.error(f"Error getting history ID: {str(e)}")
+            return None
+
+    def has_new_messages(self, start_history_id: str) -> Optional[bool]:
+        """Check whether any message reached the inbox since start_history_id; None when unknown"""
+        try:
+            # Limited to the inbox, so the forwards and reports this app sends do not count
+            response = self._exec_with_retry(self.service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                labelId='INBOX',
+                maxResults=1,
+                fields='history/id'
+            ))
+            return bool(response.get('history'))
+        except HttpError as e:
+            # 404 means the history ID is too old; callers fall back to a full scan
+            if e.resp.status != 404:
+                self.logger.error(f"Error listing mailbox history: {str(e)}")
+            return None
+        except Exception as e:
+            self.logger.error(f"Error listing mailbox history: {str(e)}")
+            return None
+
     def mark_as_read(self, email_id: str) -> bool:
         """Mark email as read"""
         try:
-            self.service.users().messages().modify(
+            self._exec_with_retry(self.service.users().messages().modify(
                 userId='me',
                 id=email_id,
                 body={'removeLabelIds': ['UNREAD']}
-            ).execute()
+            ))
+            # Cached copy has stale labels now
+            self._message_cache.pop(email_id, None)
             return True
         except Exception as e:
             self.logger.error(f"Error marking email as read: {str(e)}")
             return False
 
+    def mark_as_read_bulk(self, email_ids: List[str]) -> List[str]:
+        """Mark several emails as read in batch requests, returning the IDs that were updated"""
+        try:
+            return self._batch_modify({email_id: {'removeLabelIds': ['UNREAD']} for email_id in email_ids})
+        except Exception as e:
+            self.logger.error(f"Error marking emails as read: {str(e)}")
+            return []
+
     def mark_important(self, msg_id: str) -> bool:
         """Mark a message as important"""
         try:
-            self.service.users().messages().modify(
+            self._exec_with_retry(self.service.users().messages().modify(
                 userId='me',
                 id=msg_id,
                 body={'addLabelIds': ['IMPORTANT']}
-            ).execute()
+            ))
+            # Cached copy has stale labels now
+            self._message_cache.pop(msg_id, None)
             self.logger.info(f"Marked message {msg_id} as important")
             return True
         except Exception as e:
             self.logger.error(f"Error marking message {msg_id} as important: {str(e)}")
             return False
 
+    def _get_label_map(self) -> Dict[str, str]:
+        """Return the lowercased label name -> ID map, listing labels only on first use"""
+        with self._label_lock:
+            if self._label_cache is None:
+                results = self._exec_with_retry(self.service.users().labels().list(userId='me'))
+                self._label_cache = {
+                    label['name'].lower(): label['id']
+                    for label in results.get('labels', [])
+                }
+            return self._label_cache
+
     def _create_label(self, label_name: str) -> Optional[str]:
         """Create a Gmail label if it doesn't exist"""
         try:
-            # First check if label already exists
             try:
-                results = self.service.users().labels().list(userId='me').execute()
-                labels = results.get('labels', [])
-                
-                # Check for existing label (case insensitive)
-                for label in labels:
-                    if label['name'].lower() == label_name.lower():
-                        return label['id']
+                label_map = self._get_label_map()
             except Exception as e:
                 self.logger.error(f"Error checking existing labels: {str(e)}")
                 return None
 
+            # Check for existing label (case insensitive)
+            label_id = label_map.get(label_name.lower())
+            if label_id:
+                return label_id
+
             # Create new label if it doesn't exist
-            label = self.service.users().labels().create(
+            label = self._exec_with_retry(self.service.users().labels().create(
                 userId='me',
                 body={
                     'name': label_name,
                     'labelListVisibility': 'labelShow',
                     'messageListVisibility': 'show'
                 }
-            ).execute()
+            ))
             
+            with self._label_lock:
+                if self._label_cache is not None:
+                    self._label_cache[label_name.lower()] = label['id']
             self.logger.info(f"Created new label: {label_name}")
             return label['id']
             
         except Exception as e:
+            # The label may have been created elsewhere; reload the labels next time
+            self._invalidate_label_cache()
             self.logger.error(f"Error creating label {label_name}: {str(e)}")
             return None
 
+    def _invalidate_label_cache(self):
+        """Forget cached label IDs so the next lookup lists labels again"""
+        with self._label_lock:
+            self._label_cache = None
+
     def add_label(self, msg_id: str, label_name: str) -> bool:
         """Add a label to a message"""
         try:
@@ -393,32 +810,55 @@ class GmailHandler:
                 return False
             
             # Add label to message
-            self.service.users().messages().modify(
+            self._exec_with_retry(self.service.users().messages().modify(
                 userId='me',
                 id=msg_id,
                 body={'addLabelIds': [label_id]}
-            ).execute()
+            ))
+            # Cached copy has stale labels now
+            self._message_cache.pop(msg_id, None)
             
             self.logger.info(f"Added label {label_name} to message {msg_id}")
             return True
             
+        except HttpError as e:
+            # A cached label that was deleted or is no longer accessible
+            if e.resp.status in (401, 404):
+                self._invalidate_label_cache()
+            self.logger.error(f"Error adding label {label_name} to message {msg_id}: {str(e)}")
+            return False
         except Exception as e:
             self.logger.error(f"Error adding label {label_name} to message {msg_id}: {str(e)}")
             return False
 
+    def _batch_modify(self, bodies: Dict[str, Dict[str, List[str]]]) -> List[str]:
+        """Apply a messages.modify body to each message in batch requests, returning the IDs that succeeded"""
+        results = self._batch_execute(list(bodies), lambda msg_id: self.service.users().messages().modify(
+            userId='me',
+            id=msg_id,
+            body=bodies[msg_id]
+        ))
+        # Cached copies have stale labels now
+        for msg_id in bodies:
+            self._message_cache.pop(msg_id, None)
+        return [msg_id for msg_id in bodies if msg_id in results]
+
     def create_message(self, sender: str, to: str, subject: str, message_html: str) -> Dict[str, Any]:
         """Create an email message with HTML content"""
         try:
-            message = MIMEMultipart('alternative')
-            message['to'] = to
-            message['from'] = sender
-            message['subject'] = subject
-            
-            # Attach HTML content
-            message.attach(MIMEText(message_html, 'html'))
+            # Single-part HTML mail needs no MIME tree, so assemble the bytes directly
+            headers = (
+                _fold_header('To', to)
+                + _fold_header('From', sender)
+                + _fold_header('Subject', subject)
+                + "MIME-Version: 1.0\r\n"
+                "Content-Type: text/html; charset=utf-8\r\n"
+                "Content-Transfer-Encoding: base64\r\n\r\n"
+            )
+            body = base64mime.body_encode(message_html.encode('utf-8'), eol='\r\n')
             
             # Encode message
-            raw = base64.urlsafe_b64encode(message.as_bytes()).decode('utf-8')
+            raw = base64.urlsafe_b64encode((headers + body).encode('ascii')).decode('ascii')
             return {'raw': raw}
             
         except Exception as e:
@@ -431,10 +871,10 @@ class GmailHandler:
             if not message:
                 return False
                 
-            self.service.users().messages().send(
+            self._exec_with_retry(self.service.users().messages().send(
                 userId='me',
                 body=message
-            ).execute()
+            ), statuses=SEND_RETRYABLE_STATUSES)
             return True
             
         except Exception as e:
@@ -1,55 +1,88 @@
+import hashlib
 import json
-from typing import Dict, Any, Optional, List
-from openai import OpenAI
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Optional, List, Tuple
 import logging
 from config import Config
-from utils import rate_limit
+from utils import rate_limit, create_chat_completion, get_openai_client
 import os
 from dotenv import load_dotenv
 import re
-client=OpenAI(
-    
-    api_key=os.getenv('OPENAI_API_KEY'),
-)
+
+try:
+    import re2 as pattern_engine
+except ImportError:  # optional speedup, fall back to the stdlib re module
+    pattern_engine = re
+
 # Load environment variables at module level
 load_dotenv(override=True)
 
-class InvoiceAnalyzer:
-    """Analyzes email content and attachments for invoice information using OpenAI."""
+# Patterns for basic invoice detection, compiled once at import; the detection
+# patterns only use syntax RE2 supports, so they can run on its linear-time engine
+AMOUNT_PATTERNS = [pattern_engine.compile(pattern) for pattern in (
+    r'(?:[\$₹€£]\s*\d+(?:,\d{3})*(?:\.\d{2})?)',  # Currency symbols with amounts
+    r'(?:\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:usd|eur|gbp|inr))',  # Amounts with currency codes
+    r'total:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
+    r'amount(?:\sdue)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
+    r'balance(?:\sdue)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
+    r'payment(?:\sof)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
+    r'(?:sub)?total:?\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?'
+)]
+
+DATE_PATTERNS = [pattern_engine.compile(pattern) for pattern in (
+    r'(?:date|dated):\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
+    r'(?:due|payment)\s*date:\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
+    r'(?:invoice|bill)\s*date:\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
+    r'(?:valid|expiry)\s*(?:until|date):\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}'
+)]
+
+# The identifier itself is captured in the "id" group
+INVOICE_IDENTIFIER_PATTERNS = [pattern_engine.compile(pattern) for pattern in (
+    r'invoice\s*(?:no\.?|number|#|id)?\s*[:.]?\s*(?P<id>[a-z0-9-]+)',
+    r'bill\s*(?:no\.?|number|#|id)?\s*[:.]?\s*(?P<id>[a-z0-9-]+)',
+    r'receipt\s*(?:no\.?|number|#|id)?\s*[:.]?\s*(?P<id>[a-z0-9-]+)',
+    r'order\s*(?:no\.?|number|#|id)?\s*[:.]?\s*(?P<id>[a-z0-9-]+)',
+    r'transaction\s*(?:no\.?|number|#|id)?\s*[:.]?\s*(?P<id>[a-z0-9-]+)'
+)]
+
+VENDOR_PATTERNS = [pattern_engine.compile(pattern) for pattern in (
+    r'(?:from|sender|company|vendor|biller|issued\s*by):\s*([^\n,]+)',
+    r'(?:business|merchant)\s*name:\s*([^\n,]+)'
+)]
+
+# Cheap keyword gate run before the OpenAI call; text without any of these terms
+# cannot be an invoice, so it is rejected without a network round trip
+INVOICE_KEYWORDS_RE = pattern_engine.compile(
+    r'invoice|bill|receipt|amount|total|payment|paid|balance|due|order|transaction'
+    r'|statement|subscription|usd|eur|gbp|inr|[\$₹€£]'
+)
 
-    def __init__(self):
-        """Initialize the InvoiceAnalyzer with OpenAI client and logging."""
-        api_key = os.getenv('OPENAI_API_KEY')
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is required")
-            
-        # Initialize OpenAI client with just the API key
-        self.client = OpenAI(api_key=api_key)
-        self.logger = logging.getLogger(__name__)
+# Confidence weights of the basic analysis and the score when every pattern matches
+AMOUNT_WEIGHT = 0.4
+DATE_WEIGHT = 0.3
+IDENTIFIER_WEIGHT = 0.3
+MAX_BASIC_SCORE = (
+    len(AMOUNT_PATTERNS) * AMOUNT_WEIGHT +
+    len(DATE_PATTERNS) * DATE_WEIGHT +
+    len(INVOICE_IDENTIFIER_PATTERNS) * IDENTIFIER_WEIGHT
+)
 
-        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024
-        self.model = "gpt-4o"
+NON_NUMERIC_RE = re.compile(r'[^\d.]')
+DATE_LABEL_RE = re.compile(r'.*?:\s*')
 
-    def analyze_content(self, text: str) -> Optional[Dict[str, Any]]:
-        """
-        Analyze text content to detect and extract invoice information.
-        Falls back to basic keyword detection if OpenAI is not available.
-        """
-        try:
-            self.logger.info("Starting content analysis")
-            self.logger.info(f"Analyzing text content (first 100 chars): {text[:100]}...")
-
-            if not self.client:
-                self.logger.info("OpenAI not available, using basic detection")
-                return self._basic_invoice_analysis(text)
+# Maximum number of OpenAI analyses run concurrently by analyze_content_batch
+MAX_CONCURRENT_ANALYSES = 8
+# Number of OpenAI analyses remembered by content hash, so re-polled emails are not re-analyzed
+ANALYSIS_CACHE_SIZE = 4096
+# Analyses below this confidence are not cached and get another chance on the next poll
+MIN_CACHED_CONFIDENCE = 0.3
+# Texts packed into one OpenAI request by analyze_content_batch, and their combined size limit
+BATCH_ANALYSIS_SIZE = 8
+BATCH_ANALYSIS_MAX_CHARS = 40000
 
-            try:
-                response = client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": """You are an expert invoice analyzer. Your task is to:
+INVOICE_ANALYSIS_PROMPT = """You are an expert invoice analyzer. Your task is to:
 1. Determine if the text contains an invoice, bill, receipt, or payment request
 2. Extract key invoice details with high precision
 3. Assign a confidence score based on the clarity and completeness of information
@@ -91,6 +124,58 @@ Respond with a JSON object in this exact format:
         "payment_terms": string | null
     }
 }"""
+
+BATCH_ANALYSIS_PROMPT = INVOICE_ANALYSIS_PROMPT + """
+
+The user message is a JSON array of {"id": integer, "text": string} items. Analyze each
+text independently and respond with a JSON object of the form
+{"results": [{"id": integer, "is_invoice": ..., "confidence": ..., "invoice_data": {...}}]}
+containing exactly one entry, in the format above, for every id."""
+
+class InvoiceAnalyzer:
+    """Analyzes email content and attachments for invoice information using OpenAI."""
+
+    def __init__(self):
+        """Initialize the InvoiceAnalyzer with OpenAI client and logging."""
+        api_key = os.getenv('OPENAI_API_KEY')
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is required")
+            
+        # Initialize OpenAI client with just the API key
+        self.client = get_openai_client(api_key)
+        self.logger = logging.getLogger(__name__)
+
+        # the newest OpenAI model is "gpt-4o" which was released May 13, 2024
+        self.model = "gpt-4o"
+        self._analysis_cache: OrderedDict = OrderedDict()  # content hash -> OpenAI analysis
+        self._cache_lock = threading.Lock()
+
+    def analyze_content(self, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Analyze text content to detect and extract invoice information.
+        Falls back to basic keyword detection if OpenAI is not available.
+        """
+        try:
+            self.logger.info("Starting content analysis")
+            self.logger.info(f"Analyzing text content (first 100 chars): {text[:100]}...")
+
+            if not self.client:
+                self.logger.info("OpenAI not available, using basic detection")
+                return self._basic_invoice_analysis(text)
+
+            cache_key = self._cache_key(text)
+            known = self._known_analysis(text, cache_key)
+            if known is not None:
+                return known
+
+            try:
+                response = create_chat_completion(
+                    self.client,
+                    model=self.model,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": INVOICE_ANALYSIS_PROMPT
                         },
                         {"role": "user", "content": text}
                     ],
@@ -109,6 +194,8 @@ Respond with a JSON object in this exact format:
                     raise ValueError("Invalid response format from OpenAI")
 
                 self.logger.info(f"Analysis completed with confidence: {analysis.get('confidence', 0)}")
+                if (analysis.get('confidence') or 0) >= MIN_CACHED_CONFIDENCE:
+                    self._cache_analysis(cache_key, analysis)
                 return analysis
 
             except Exception as e:
@@ -120,6 +207,100 @@ Respond with a JSON object in this exact format:
             self.logger.error(f"Error analyzing content: {str(e)}")
             return None
 
+    def _known_analysis(self, text: str, cache_key: bytes) -> Optional[Dict[str, Any]]:
+        """Answer without OpenAI when the text has no invoice keywords or was analyzed before"""
+        if not INVOICE_KEYWORDS_RE.search(text.lower()):
+            self.logger.info("No invoice keywords found, skipping OpenAI analysis")
+            return {'is_invoice': False, 'confidence': 0.0, 'invoice_data': {}}
+
+        with self._cache_lock:
+            cached = self._analysis_cache.get(cache_key)
+            if cached is not None:
+                self._analysis_cache.move_to_end(cache_key)
+        if cached is not None:
+            self.logger.info("Using cached analysis for identical content")
+        return cached
+
+    def _cache_key(self, text: str) -> bytes:
+        """Hash the model and text into a compact cache key"""
+        return hashlib.blake2b(f"{self.model}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def _cache_analysis(self, cache_key: bytes, analysis: Dict[str, Any]) -> None:
+        """Remember an OpenAI analysis, evicting the least recently used one when full"""
+        with self._cache_lock:
+            self._analysis_cache[cache_key] = analysis
+            self._analysis_cache.move_to_end(cache_key)
+            if len(self._analysis_cache) > ANALYSIS_CACHE_SIZE:
+                self._analysis_cache.popitem(last=False)
+
+    def analyze_content_batch(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Analyze several texts, packing them into shared OpenAI requests, in input order"""
+        if len(texts) <= 1 or not self.client:
+            return [self.analyze_content(text) for text in texts]
+
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        chunks: List[List[Tuple[int, bytes]]] = []
+        chunk_chars = 0
+        for index, text in enumerate(texts):
+            cache_key = self._cache_key(text)
+            known = self._known_analysis(text, cache_key)
+            if known is not None:
+                results[index] = known
+                continue
+
+            # Start a new request when the current one is full
+            if (not chunks or len(chunks[-1]) >= BATCH_ANALYSIS_SIZE
+                    or chunk_chars + len(text) > BATCH_ANALYSIS_MAX_CHARS):
+                chunks.append([])
+                chunk_chars = 0
+            chunks[-1].append((index, cache_key))
+            chunk_chars += len(text)
+
+        def analyze_chunk(chunk: List[Tuple[int, bytes]]) -> List[Optional[Dict[str, Any]]]:
+            if len(chunk) == 1:
+                return [self.analyze_content(texts[chunk[0][0]])]
+            return self._analyze_chunk([texts[index] for index, _ in chunk], [key for _, key in chunk])
+
+        # The calls are network-bound; the shared rate limiter still paces them
+        with ThreadPoolExecutor(max_workers=max(1, min(MAX_CONCURRENT_ANALYSES, len(chunks)))) as executor:
+            for chunk, analyses in zip(chunks, executor.map(analyze_chunk, chunks)):
+                for (index, _), analysis in zip(chunk, analyses):
+                    results[index] = analysis
+        return results
+
+    def _analyze_chunk(self, texts: List[str], cache_keys: List[bytes]) -> List[Optional[Dict[str, Any]]]:
+        """Analyze several texts in one OpenAI request, analyzing singly any it fails to answer"""
+        try:
+            response = create_chat_completion(
+                self.client,
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": BATCH_ANALYSIS_PROMPT},
+                    {"role": "user", "content": json.dumps(
+                        [{"id": index, "text": text} for index, text in enumerate(texts)]
+                    )}
+                ],
+                response_format={"type": "json_object"},
+                temperature=0.1
+            )
+            items = json.loads(response.choices[0].message.content).get('results', [])
+            by_id = {str(item.pop('id', None)): item for item in items if isinstance(item, dict)}
+            self.logger.info(f"Batched OpenAI analysis completed for {len(by_id)} of {len(texts)} texts")
+        except Exception as e:
+            self.logger.error(f"Batched OpenAI analysis error: {str(e)}")
+            by_id = {}
+
+        analyses = []
+        for index, (text, cache_key) in enumerate(zip(texts, cache_keys)):
+            analysis = by_id.get(str(index))
+            if analysis is None:
+                analyses.append(self.analyze_content(text))
+                continue
+            if (analysis.get('confidence') or 0) >= MIN_CACHED_CONFIDENCE:
+                self._cache_analysis(cache_key, analysis)
+            analyses.append(analysis)
+        return analyses
+
     def _basic_invoice_analysis(self, text: str) -> Dict[str, Any]:
         """
         Perform basic invoice analysis without OpenAI
@@ -127,96 +308,53 @@ Respond with a JSON object in this exact format:
         """
         text_lower = text.lower()
 
-        # Enhanced keyword sets for different aspects
-        amount_patterns = [
-            r'(?:[\$₹€£]\s*\d+(?:,\d{3})*(?:\.\d{2})?)',  # Currency symbols with amounts
-            r'(?:\d+(?:,\d{3})*(?:\.\d{2})?\s*(?:usd|eur|gbp|inr))',  # Amounts with currency codes
-            r'total:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
-            r'amount(?:\sdue)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
-            r'balance(?:\sdue)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
-            r'payment(?:\sof)?:\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?',
-            r'(?:sub)?total:?\s*[\$₹€£]?\s*\d+(?:,\d{3})*(?:\.\d{2})?'
-        ]
-
-        date_patterns = [
-            r'(?:date|dated):\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
-            r'(?:due|payment)\s*date:\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
-            r'(?:invoice|bill)\s*date:\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}',
-            r'(?:valid|expiry)\s*(?:until|date):\s*\d{1,2}[-/\.]\d{1,2}[-/\.]\d{2,4}'
-        ]
-
-        invoice_identifiers = [
-            r'invoice\s*(?:no\.?|number|#|id)?\s*[:.]?\s*[a-z0-9-]+',
-            r'bill\s*(?:no\.?|number|#|id)?\s*[:.]?\s*[a-z0-9-]+',
-            r'receipt\s*(?:no\.?|number|#|id)?\s*[:.]?\s*[a-z0-9-]+',
-            r'order\s*(?:no\.?|number|#|id)?\s*[:.]?\s*[a-z0-9-]+',
-            r'transaction\s*(?:no\.?|number|#|id)?\s*[:.]?\s*[a-z0-9-]+'
-        ]
-
-        # Calculate confidence based on pattern matches
-        amount_matches = sum(1 for pattern in amount_patterns if re.search(pattern, text_lower))
-        date_matches = sum(1 for pattern in date_patterns if re.search(pattern, text_lower))
-        identifier_matches = sum(1 for pattern in invoice_identifiers if re.search(pattern, text_lower))
+        # Search every pattern once; the matches drive both confidence and extraction
+        amount_matches = [m for m in (p.search(text_lower) for p in AMOUNT_PATTERNS) if m]
+        date_matches = [m for m in (p.search(text_lower) for p in DATE_PATTERNS) if m]
+        identifier_matches = [m for m in (p.search(text_lower) for p in INVOICE_IDENTIFIER_PATTERNS) if m]
 
         # Weight the matches differently
         confidence = (
-            (amount_matches * 0.4) +    # Amount patterns are strong indicators
-            (date_matches * 0.3) +      # Dates are good indicators
-            (identifier_matches * 0.3)   # Invoice numbers are good indicators
-        ) / (
-            len(amount_patterns) * 0.4 +
-            len(date_patterns) * 0.3 +
-            len(invoice_identifiers) * 0.3
-        )
+            (len(amount_matches) * AMOUNT_WEIGHT) +    # Amount patterns are strong indicators
+            (len(date_matches) * DATE_WEIGHT) +      # Dates are good indicators
+            (len(identifier_matches) * IDENTIFIER_WEIGHT)   # Invoice numbers are good indicators
+        ) / MAX_BASIC_SCORE
 
         # Extract invoice data
         invoice_data = {}
 
         # Try to extract invoice number
-        for pattern in invoice_identifiers:
-            if matches := re.search(pattern, text_lower):
-                invoice_num = matches.group(0)
-                for prefix in ['invoice', 'bill', 'receipt', 'order', 'transaction', 'no', 'number', '#', 'id', ':', '.']:
-                    invoice_num = re.sub(f'{prefix}\s*', '', invoice_num, flags=re.IGNORECASE)
-                invoice_data['invoice_number'] = invoice_num.strip()
-                break
+        if identifier_matches:
+            invoice_data['invoice_number'] = identifier_matches[0].group('id')
 
         # Try to extract amount
-        for pattern in amount_patterns:
-            if matches := re.search(pattern, text_lower):
-                try:
-                    amount_str = matches.group(0)
-                    amount = float(re.sub(r'[^\d.]', '', amount_str))
-                    currency = 'USD'  # Default to USD
-                    if '₹' in amount_str or 'inr' in amount_str:
-                        currency = 'INR'
-                    elif '€' in amount_str or 'eur' in amount_str:
-                        currency = 'EUR'
-                    elif '£' in amount_str or 'gbp' in amount_str:
-                        currency = 'GBP'
-                    invoice_data['total_amount'] = {
-                        'amount': amount,
-                        'currency': currency
-                    }
-                    break
-                except ValueError:
-                    continue
+        for matches in amount_matches:
+            try:
+                amount_str = matches.group(0)
+                amount = float(NON_NUMERIC_RE.sub('', amount_str))
+                currency = 'USD'  # Default to USD
+                if '₹' in amount_str or 'inr' in amount_str:
+                    currency = 'INR'
+                elif '€' in amount_str or 'eur' in amount_str:
+                    currency = 'EUR'
+                elif '£' in amount_str or 'gbp' in amount_str:
+                    currency = 'GBP'
+                invoice_data['total_amount'] = {
+                    'amount': amount,
+                    'currency': currency
+                }
+                break
+            except ValueError:
+                continue
 
         # Try to extract date
-        for pattern in date_patterns:
-            if matches := re.search(pattern, text_lower):
-                date_str = matches.group(0)
-                date_str = re.sub(r'.*?:\s*', '', date_str)
-                invoice_data['date'] = date_str.strip()
-                break
+        if date_matches:
+            date_str = DATE_LABEL_RE.sub('', date_matches[0].group(0))
+            invoice_data['date'] = date_str.strip()
 
         # Extract vendor information if present
-        vendor_patterns = [
-            r'(?:from|sender|company|vendor|biller|issued\s*by):\s*([^\n,]+)',
-            r'(?:business|merchant)\s*name:\s*([^\n,]+)'
-        ]
-        for pattern in vendor_patterns:
-            if matches := re.search(pattern, text_lower):
+        for pattern in VENDOR_PATTERNS:
+            if matches := pattern.search(text_lower):
                 vendor_name = matches.group(1).strip()
                 if len(vendor_name) > 3:  # Avoid very short/invalid names
                     invoice_data['vendor'] = {
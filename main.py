@@ -2,13 +2,18 @@ import os
 import time
 import logging
 import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Any
 from config import Config
+from gmail_auth import GmailAuthenticator
 from gmail_handler import GmailHandler
 from invoice_analyzer import InvoiceAnalyzer
 from utils import setup_logging, ensure_directory_exists, extract_pdf_text, is_valid_attachment
 from app import app
 
+# Maximum number of emails processed concurrently
+MAX_CONCURRENT_EMAILS = 4
+
 def run_flask_server():
     """Run the Flask server for OAuth2 callback"""
     try:
@@ -27,12 +32,15 @@ def process_attachments(gmail: GmailHandler, email_data: Dict[str, Any]) -> List
     processed_attachments = []
 
     try:
+        # Download all attachments of the email in one batch
+        contents = gmail.download_attachments(
+            email_data['id'],
+            [attachment['attachment_id'] for attachment in email_data['attachments']]
+        )
+
         for attachment in email_data['attachments']:
-            logger.info(f"Processing attachment: {attachment['filename']}")
-            content = gmail.download_attachment(
-                email_data['id'], 
-                attachment['attachment_id']
-            )
+            logger.debug("Processing attachment: %s", attachment['filename'])
+            content = contents.get(attachment['attachment_id'])
 
             if content and is_valid_attachment(
                 attachment['filename'],
@@ -42,9 +50,9 @@ def process_attachments(gmail: GmailHandler, email_data: Dict[str, Any]) -> List
                     'filename': attachment['filename'],
                     'content': content
                 })
-                logger.info(f"Successfully processed attachment: {attachment['filename']}")
+                logger.debug("Successfully processed attachment: %s", attachment['filename'])
             else:
-                logger.warning(f"Skipped invalid attachment: {attachment['filename']}")
+                logger.warning("Skipped invalid attachment: %s", attachment['filename'])
     except Exception as e:
         logger.error(f"Error processing attachments: {str(e)}")
 
@@ -57,53 +65,130 @@ def analyze_email_content(
 ) -> Dict[str, Any]:
     """Analyze email content and attachments"""
     logger = logging.getLogger(__name__)
-    logger.info("Starting content analysis")
+    logger.debug("Starting content analysis")
 
     try:
         # Analyze email body
         body_analysis = analyzer.analyze_content(email_body)
         if body_analysis:
-            logger.info(f"Email body analysis completed - "
-                       f"Is Invoice: {body_analysis.get('is_invoice', False)}, "
-                       f"Confidence: {body_analysis.get('confidence', 0)}")
+            logger.debug("Email body analysis completed - Is Invoice: %s, Confidence: %s",
+                         body_analysis.get('is_invoice', False),
+                         body_analysis.get('confidence', 0))
             if body_analysis.get('is_invoice'):
-                logger.info(f"Invoice details found in body: "
-                          f"{body_analysis.get('invoice_data', {})}")
-
-        # Analyze PDF attachments
-        pdf_analyses = []
+                logger.debug("Invoice details found in body: %s",
+                             body_analysis.get('invoice_data', {}))
+                # The body wins over attachments, so the PDFs need not be parsed
+                logger.info("Using invoice details from email body")
+                return body_analysis
+
+        # Analyze PDF attachments concurrently
+        pdf_texts = []
         for attachment in attachments:
             if attachment['filename'].lower().endswith('.pdf'):
-                logger.info(f"Analyzing PDF: {attachment['filename']}")
+                logger.debug("Analyzing PDF: %s", attachment['filename'])
                 pdf_text = extract_pdf_text(attachment['content'])
                 if pdf_text:
-                    pdf_analysis = analyzer.analyze_pdf_content(pdf_text)
-                    if pdf_analysis:
-                        logger.info(f"PDF analysis completed - "
-                                  f"Is Invoice: {pdf_analysis.get('is_invoice', False)}, "
-                                  f"Confidence: {pdf_analysis.get('confidence', 0)}")
-                        if pdf_analysis.get('is_invoice'):
-                            logger.info(f"Invoice details found in PDF: "
-                                      f"{pdf_analysis.get('invoice_data', {})}")
-                        pdf_analyses.append(pdf_analysis)
+                    pdf_texts.append(pdf_text)
 
-        # Combine analyses
-        if body_analysis and body_analysis.get('is_invoice'):
-            logger.info("Using invoice details from email body")
-            return body_analysis
+        pdf_analyses = []
+        for pdf_analysis in analyzer.analyze_content_batch(pdf_texts):
+            if pdf_analysis:
+                logger.debug("PDF analysis completed - Is Invoice: %s, Confidence: %s",
+                             pdf_analysis.get('is_invoice', False),
+                             pdf_analysis.get('confidence', 0))
+                if pdf_analysis.get('is_invoice'):
+                    logger.debug("Invoice details found in PDF: %s",
+                                 pdf_analysis.get('invoice_data', {}))
+                pdf_analyses.append(pdf_analysis)
 
+        # Combine analyses
         for pdf_analysis in pdf_analyses:
             if pdf_analysis.get('is_invoice'):
                 logger.info("Using invoice details from PDF attachment")
                 return pdf_analysis
 
-        logger.info("No invoice detected in content")
+        logger.debug("No invoice detected in content")
         return body_analysis if body_analysis else {'is_invoice': False, 'confidence': 0}
 
     except Exception as e:
-        logger.error(f"Error in content analysis: {str(e)}")
+        logger.error("Error in content analysis: %s", e)
         return {'is_invoice': False, 'confidence': 0}
 
+def process_email(gmail: GmailHandler, analyzer: InvoiceAnalyzer, config: Config, email: Dict[str, Any]):
+    """Forward or analyze one email, then mark it as read"""
+    logger = logging.getLogger(__name__)
+    logger.info("Processing email: %s", email['subject'])
+    sender_email = email.get('sender', '').lower()
+
+    try:
+        # Check for direct forwarding first
+        direct_forwarded = False
+        for category, settings in config.EMAIL_CATEGORIES.items():
+            if (settings.get('direct_forward', False) and 
+                settings.get('enabled', True) and 
+                any(sender_email.endswith(from_email.lower()) 
+                    for from_email in settings.get('from_emails', []))):
+                
+                logger.info("Direct forwarding email from %s based on %s category", sender_email, category)
+                
+                # Forward to target emails, with the original and its attachments attached
+                for target_email in settings.get('target_emails', []):
+                    success = gmail.forward_message(
+                        email['id'],
+                        to_email=target_email,
+                        subject=f"FWD: {email['subject']} [{category}]",
+                        body=f"""Original email from: {email['sender']}
+                        \n\nOriginal message:
+                        {email['body']}""",
+                        cc_list=settings.get('cc_to', [])
+                    )
+                    if success:
+                        logger.info("Email directly forwarded to %s", target_email)
+                
+                direct_forwarded = True
+                break
+
+        # If not directly forwarded, proceed with normal processing
+        if not direct_forwarded:
+            # Process attachments
+            attachments = process_attachments(gmail, email)
+            logger.debug("Processed %d attachments", len(attachments))
+
+            # Analyze content
+            analysis_result = analyze_email_content(
+                analyzer,
+                email['body'],
+                attachments
+            )
+
+            # Forward if invoice detected
+            if analyzer.should_forward(analysis_result):
+                logger.info("Invoice detected, forwarding email")
+
+                for target_email in config.TARGET_EMAILS:
+                    success = gmail.forward_email(
+                        to_email=target_email,
+                        subject=f"FWD: {email['subject']} - Invoice Detected",
+                        body=f"""Original email from: {email['sender']}
+                        \n\nInvoice Details:
+                        {analysis_result['invoice_data']}
+                        \n\nOriginal message:
+                        {email['body']}""",
+                        attachments=attachments
+                    )
+
+                    if success:
+                        logger.info("Email forwarded to %s", target_email)
+
+        # Mark email as read after processing
+        if gmail.mark_as_read(email['id']):
+            logger.debug("Email marked as read")
+        else:
+            logger.error("Failed to mark email as read")
+
+    except Exception as e:
+        logger.error("Error processing email: %s", e)
+
 def process_emails(gmail: GmailHandler, analyzer: InvoiceAnalyzer, config: Config):
     """Process emails from all source addresses"""
     logger = logging.getLogger(__name__)
@@ -113,82 +198,12 @@ def process_emails(gmail: GmailHandler, analyzer: InvoiceAnalyzer, config: Confi
 
         try:
             # Get unread emails
-            emails = gmail.get_unread_emails(source_email)
+            emails = gmail.get_unread_emails(source_email, include_body=True)
             logger.info(f"Found {len(emails)} unread emails")
 
-            for email in emails:
-                logger.info(f"Processing email: {email['subject']}")
-                sender_email = email.get('sender', '').lower()
-
-                try:
-                    # Check for direct forwarding first
-                    direct_forwarded = False
-                    for category, settings in config.EMAIL_CATEGORIES.items():
-                        if (settings.get('direct_forward', False) and 
-                            settings.get('enabled', True) and 
-                            any(sender_email.endswith(from_email.lower()) 
-                                for from_email in settings.get('from_emails', []))):
-                            
-                            logger.info(f"Direct forwarding email from {sender_email} based on {category} category")
-                            
-                            # Forward to target emails
-                            for target_email in settings.get('target_emails', []):
-                                success = gmail.forward_email(
-                                    to_email=target_email,
-                                    subject=f"FWD: {email['subject']} [{category}]",
-                                    body=f"""Original email from: {email['sender']}
-                                    \n\nOriginal message:
-                                    {email['body']}""",
-                                    attachments=email.get('attachments', []),
-                                    cc_list=settings.get('cc_to', [])
-                                )
-                                if success:
-                                    logger.info(f"Email directly forwarded to {target_email}")
-                            
-                            direct_forwarded = True
-                            break
-
-                    # If not directly forwarded, proceed with normal processing
-                    if not direct_forwarded:
-                        # Process attachments
-                        attachments = process_attachments(gmail, email)
-                        logger.info(f"Processed {len(attachments)} attachments")
-
-                        # Analyze content
-                        analysis_result = analyze_email_content(
-                            analyzer,
-                            email['body'],
-                            attachments
-                        )
-
-                        # Forward if invoice detected
-                        if analyzer.should_forward(analysis_result):
-                            logger.info("Invoice detected, forwarding email")
-
-                            for target_email in config.TARGET_EMAILS:
-                                success = gmail.forward_email(
-                                    to_email=target_email,
-                                    subject=f"FWD: {email['subject']} - Invoice Detected",
-                                    body=f"""Original email from: {email['sender']}
-                                    \n\nInvoice Details:
-                                    {analysis_result['invoice_data']}
-                                    \n\nOriginal message:
-                                    {email['body']}""",
-                                    attachments=attachments
-                                )
-
-                                if success:
-                                    logger.info(f"Email forwarded to {target_email}")
-
-                    # Mark email as read after processing
-                    if gmail.mark_as_read(email['id']):
-                        logger.info("Email marked as read")
-                    else:
-                        logger.error("Failed to mark email as read")
-
-                except Exception as e:
-                    logger.error(f"Error processing email: {str(e)}")
-                    continue
+            # Emails are independent and their processing is network-bound
+            with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_EMAILS) as executor:
+                list(executor.map(lambda email: process_email(gmail, analyzer, config, email), emails))
 
         except Exception as e:
             logger.error(f"Error getting emails: {str(e)}")
@@ -235,10 +250,23 @@ def main():
         # Main monitoring loop
         logger.info("Starting continuous email monitoring")
         check_interval = 60  # Check every minute
+        full_scan_every = 15  # Rescan unread mail at least every 15 checks to retry failed emails
+        history_id = None
+        checks_since_scan = 0
 
         while True:
             try:
-                process_emails(gmail, analyzer, config)
+                # Only scan unread mail when messages arrived since the last scan
+                if (history_id and checks_since_scan < full_scan_every
+                        and gmail.has_new_messages(history_id) is False):
+                    checks_since_scan += 1
+                    logger.info("No new messages since last check")
+                else:
+                    # Taken before the scan so mail arriving during it is seen next time
+                    next_history_id = gmail.get_history_id()
+                    process_emails(gmail, analyzer, config)
+                    history_id = next_history_id
+                    checks_since_scan = 0
                 logger.info(f"Waiting {check_interval} seconds before next check...")
                 time.sleep(check_interval)
 
@@ -1,5 +1,7 @@
-from gmail_handler import GmailHandler
+from gmail_handler import GmailHandler, LIST_BODY_FIELDS
+from gmail_auth import parse_token_data
 from email_classifier import EmailClassifier
+import html
 import json
 from datetime import datetime, timedelta
 import logging
@@ -10,12 +12,97 @@ from typing import Dict, Any, List, Optional
 from report_generator import ReportGenerator
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
+from email.utils import getaddresses, parsedate_to_datetime
 import os
-from openai import OpenAI
 from calendar_handler import CalendarHandler
-from collections import defaultdict
+from utils import create_chat_completion, get_openai_client
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 import argparse
 
+# Patterns stripped from AI responses by _clean_ai_response
+CODE_FENCE_RE = re.compile(r'```\w*\n?')
+HTML_COMMENT_RE = re.compile(r'<!--.*?-->', re.DOTALL)
+EXTRA_NEWLINES_RE = re.compile(r'\n{3,}')
+
+# Static start and end of the HTML report built by _generate_report_html
+REPORT_HTML_HEAD = """<html>
+<head>
+    <style>
+        body {
+            font-family: Arial, sans-serif;
+            line-height: 1.6;
+            color: #333;
+            max-width: 800px;
+            margin: 0 auto;
+            padding: 20px;
+        }
+        .section {
+            margin: 20px 0;
+            padding: 15px;
+            background-color: #fff;
+            border-radius: 5px;
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+        }
+        h2 {
+            color: #2c3e50;
+            margin-top: 0;
+        }
+        .stats-table {
+            width: 100%;
+            border-collapse: collapse;
+        }
+        .stats-table th, .stats-table td {
+            padding: 12px;
+            text-align: left;
+            border-bottom: 1px solid #ddd;
+        }
+        .stats-table th {
+            background-color: #f8f9fa;
+            font-weight: bold;
+        }
+        .priority-high {
+            color: #e74c3c;
+        }
+        .priority-medium {
+            color: #f39c12;
+        }
+        .priority-low {
+            color: #27ae60;
+        }
+    </style>
+</head>
+<body>
+"""
+REPORT_HTML_FOOT = """
+</body>
+</html>
+"""
+
+# Maximum number of calendar reminders created concurrently
+MAX_CONCURRENT_REMINDERS = 5
+
+# Report colors of calendar reminder priorities
+PRIORITY_COLORS = {
+    'high': '#e74c3c',
+    'urgent': '#c0392b',
+    'normal': '#3498db',
+    'low': '#7f8c8d'
+}
+
+def parse_email_date(date: Optional[str]) -> datetime:
+    """Parse an RFC 2822 (or ISO 8601) Date header, falling back to now"""
+    if not date:
+        return datetime.now()
+    try:
+        return parsedate_to_datetime(date)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return datetime.fromisoformat(date)
+    except ValueError:
+        return datetime.now()
+
 class EmailProcessor:
     def __init__(self, gmail_handler, config):
         """Initialize the email processor with handlers and config"""
@@ -28,13 +115,13 @@ class EmailProcessor:
             'total_emails_processed': 0,
             'actionable_emails': 0,  # New counter for emails that had actions taken
             'emails_forwarded': 0,
-            'category_stats': defaultdict(int),
+            'category_stats': Counter(),
             'forwarding_details': [],
             'calendar_events': [],
             'action_items': [],
             'start_time': datetime.now()
         }
-        self.openai_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self.openai_client = get_openai_client(os.getenv('OPENAI_API_KEY'))
 
     def process_emails(self, max_emails: int = 10):
         """Process unread emails and generate summary"""
@@ -52,57 +139,43 @@ class EmailProcessor:
             # Get unread messages
             messages = self.gmail.list_messages(query='is:unread', max_results=max_emails)
             self.summary['total_emails_processed'] = len(messages)
-            
+
+            # Get message details for all messages in batch requests, skipping the
+            # nested MIME parts that are never read
+            fetched = self.gmail.get_messages([message['id'] for message in messages], fields=LIST_BODY_FIELDS)
+
+            # Extract email details; headers and body come from one pass over the payload
+            parsed = []
             for message in messages:
-                try:
-                    # Track if any action was taken for this email
-                    email_had_action = False
-                    
-                    # Get full message details
-                    msg_data = self.gmail.get_message(message['id'])
-                    if not msg_data:
-                        continue
+                msg_data = fetched.get(message['id'])
+                if msg_data:
+                    headers, body, _ = self.gmail._parse_message(msg_data)
+                    parsed.append((message, headers, body))
+
+            user_email_lower = user_email.lower()
+
+            # Classify all emails together so they share OpenAI requests
+            classifications = self.classifier.classify_emails([
+                {
+                    'subject': headers.get('subject', 'No Subject'),
+                    'sender': headers.get('from', 'Unknown'),
+                    'body': body
+                }
+                for _, headers, body in parsed
+            ])
 
-                    # Extract email details
-                    headers = msg_data['payload']['headers']
-                    subject = next((h['value'] for h in headers if h['name'].lower() == 'subject'), 'No Subject')
-                    sender = next((h['value'] for h in headers if h['name'].lower() == 'from'), 'Unknown')
-                    to = next((h['value'] for h in headers if h['name'].lower() == 'to'), '')
-                    cc = next((h['value'] for h in headers if h['name'].lower() == 'cc'), '')
-                    date = next((h['value'] for h in headers if h['name'].lower() == 'date'), None)
-                    body = self.gmail._get_message_body(msg_data)
-
-                    # Check if user is in CC
-                    cc_list = [email.strip() for email in cc.split(',') if email.strip()]
-                    is_cc = any(user_email.lower() in cc_email.lower() for cc_email in cc_list)
-
-                    # Parse date if available
-                    try:
-                        if date:
-                            for fmt in [
-                                '%a, %d %b %Y %H:%M:%S %z',  # RFC 2822
-                                '%a, %d %b %Y %H:%M:%S %Z',  # RFC 2822 with timezone name
-                                '%Y-%m-%dT%H:%M:%S%z',       # ISO 8601
-                                '%Y-%m-%d %H:%M:%S%z'        # Common format
-                            ]:
-                                try:
-                                    email_date = datetime.strptime(date, fmt)
-                                    break
-                                except ValueError:
-                                    continue
-                            else:
-                                email_date = datetime.now()
-                        else:
-                            email_date = datetime.now()
-                    except (ValueError, TypeError):
-                        email_date = datetime.now()
-                    
-                    # Classify email
-                    classification = self.classifier.classify_email({
-                        'subject': subject,
-                        'sender': sender,
-                        'body': body
-                    })
+            # Gmail mutations are collected per email and sent together in batch requests
+            pending_forwards = []  # forward_emails arguments
+            pending_marks = []  # IDs of emails to mark as read
+            processed = []  # (message ID, forwarding details, pending forward indexes, category)
+            # Calendar reminders are created after the loop:
+            # (index into processed, email data, classification, category, calendar settings)
+            calendar_jobs = []
+            
+            for (message, headers, body), classification in zip(parsed, classifications):
+                try:
+                    subject = headers.get('subject', 'No Subject')
+                    sender = headers.get('from', 'Unknown')
                     
                     # Update category stats
                     primary_category = classification.get('categories', [])[0] if classification.get('categories', []) else None
@@ -111,8 +184,8 @@ class EmailProcessor:
                     
                     # Skip if spam
                     if classification.get('spam', False):
-                        self.logger.info(f"Skipping spam email: {subject}")
-                        self.gmail.mark_as_read(message['id'])
+                        self.logger.debug("Skipping spam email: %s", subject)
+                        pending_marks.append(message['id'])
                         continue
 
                     # Extract sender's email address from the From field
@@ -124,13 +197,12 @@ class EmailProcessor:
 
                     # Get target emails for forwarding
                     targets = self.classifier.get_target_emails(classification, sender_email)
-                    forwarding_success = False
 
-                    # Forward to each target
-                    forwarded_to = []
+                    # Queue a forward to each target
+                    forward_indexes = []
+                    forwarding_details = None
                     if targets:
-                        for target in targets:
-                            disclaimer = f"""
+                        disclaimer = f"""
                             
                             ----------------------------------------
                             This email was automatically forwarded by InboxIQ on behalf of:
@@ -140,48 +212,46 @@ class EmailProcessor:
                             
                             Email processed and forwarded using InboxIQ - Intelligent Email Management System
                             ----------------------------------------"""
-                            
-                            if self.gmail.forward_email(
-                                to_email=target['email'],
-                                subject=f"FWD: {subject}",
-                                body=f"""Original email from: {sender}
+                        forward_body = f"""Original email from: {sender}
                                 \n\nCategories: {', '.join(classification.get('categories', []))}
                                 Priority: {classification.get('priority', 'normal')}
                                 \n\nAction Items:
                                 {chr(10).join(['- ' + item for item in classification.get('action_items', [])])}
                                 \n\nOriginal message:
                                 {body}
-                                {disclaimer}""",
-                                attachments=[]  # Add attachments if needed
-                            ):
-                                forwarded_to.append(target['email'])
-                                forwarding_success = True
-                                self.summary['emails_forwarded'] += 1
-
-                    # Add to forwarding details
-                    if forwarding_success:
-                        self.summary['forwarding_details'].append({
+                                {disclaimer}"""
+
+                        for target in targets:
+                            forward_indexes.append(len(pending_forwards))
+                            pending_forwards.append({
+                                'to_email': target['email'],
+                                'subject': f"FWD: {subject}",
+                                'body': forward_body
+                            })
+
+                        # Check if user is in CC; the substring search rules out most emails cheaply,
+                        # then only exact addresses count, not e.g. a longer address or a display name
+                        cc = headers.get('cc', '')
+                        cc_lower = cc.lower()
+                        is_cc = user_email_lower in cc_lower and user_email_lower in {
+                            address for _, address in getaddresses([cc_lower])
+                        }
+
+                        # Forwarding details, recorded once the forwards are sent
+                        forwarding_details = {
                             'subject': subject,
                             'from': sender,
-                            'to': to,
+                            'to': headers.get('to', ''),
                             'cc': cc,
                             'cc_recipient': is_cc,
-                            'date': email_date,
+                            'date': parse_email_date(headers.get('date')),
                             'categories': classification.get('categories', []),
                             'priority': classification.get('priority', 'normal'),
-                            'action_items': classification.get('action_items', []),
-                            'forwarded_to': forwarded_to
-                        })
-
-                    # Update action tracking based on forwarding
-                    if forwarding_success:
-                        email_had_action = True
-                        self.summary['actionable_emails'] += 1
+                            'action_items': classification.get('action_items', [])
+                        }
 
                     # Store action items in summary if present
                     if classification.get('action_items'):
-                        if 'action_items' not in self.summary:
-                            self.summary['action_items'] = []
                         self.summary['action_items'].append({
                             'sender': sender,
                             'subject': subject,
@@ -195,7 +265,7 @@ class EmailProcessor:
                         calendar_settings = category_config.get('calendar_settings', {})
                         
                         if calendar_settings.get('create_reminder', False):
-                            # Process email with AI first
+                            # Email data for the reminder, analyzed with AI when it is created
                             email_data = {
                                 'subject': subject,
                                 'sender': sender,
@@ -207,56 +277,91 @@ class EmailProcessor:
                                     'priority': classification.get('priority', 'normal')
                                 }
                             }
-                            
-                            # Process with AI to get additional insights
-                            ai_result = self.process_email_with_ai(email_data)
-                            
-                            # Ensure ai_analysis is a dictionary
-                            if isinstance(ai_result.get('ai_analysis'), str):
-                                try:
-                                    ai_result['ai_analysis'] = json.loads(ai_result['ai_analysis'])
-                                except:
-                                    ai_result['ai_analysis'] = {
-                                        'action_items': classification.get('action_items', []),
-                                        'key_points': classification.get('key_points', []),
-                                        'priority': classification.get('priority', 'normal')
-                                    }
-
-                            event_id = self.calendar.create_reminder(
-                                email_data=ai_result,
-                                category=primary_category,
-                                calendar_settings=calendar_settings
-                            )
-
-                            if event_id:
-                                email_had_action = True
-                                event_link = self.calendar.get_event_link(event_id)
-                                self.summary['calendar_events'].append({
-                                    'subject': subject,
-                                    'category': primary_category,
-                                    'event_link': event_link,
-                                    'priority': classification.get('priority', 'normal')
-                                })
-                                self.logger.info(f"Created calendar event for: {subject}")
+                            calendar_jobs.append((len(processed), email_data, classification,
+                                                  primary_category, calendar_settings))
 
-                    # Update category stats only for actionable emails
-                    if email_had_action:
-                        self.summary['category_stats'][primary_category] += 1
-
-                    # Mark as read if forwarding was successful or no targets
-                    if forwarding_success or not targets:
-                        self.gmail.mark_as_read(message['id'])
+                    processed.append((message['id'], forwarding_details, forward_indexes, primary_category))
 
                 except Exception as e:
-                    self.logger.error(f"Error processing message {message['id']}: {str(e)}")
+                    self.logger.error("Error processing message %s: %s", message['id'], e)
                     continue
 
+            # Reminders are independent network round trips, so create them concurrently
+            emails_with_events = set()
+            if calendar_jobs:
+                with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_REMINDERS, len(calendar_jobs))) as executor:
+                    event_ids = list(executor.map(lambda job: self._create_calendar_reminder(*job[1:]), calendar_jobs))
+                for (index, email_data, classification, primary_category, _), event_id in zip(calendar_jobs, event_ids):
+                    if event_id:
+                        emails_with_events.add(index)
+                        self.summary['calendar_events'].append({
+                            'subject': email_data['subject'],
+                            'category': primary_category,
+                            'event_link': self.calendar.get_event_link(event_id),
+                            'priority': classification.get('priority', 'normal')
+                        })
+                        self.logger.info("Created calendar event for: %s", email_data['subject'])
+
+            # Send all forwards together, then record what happened to each email
+            forward_results = self.gmail.forward_emails(pending_forwards) if pending_forwards else []
+            for index, (message_id, forwarding_details, forward_indexes, primary_category) in enumerate(processed):
+                # Track if any action was taken for this email
+                email_had_action = index in emails_with_events
+                forwarded_to = [pending_forwards[i]['to_email'] for i in forward_indexes if forward_results[i]]
+                forwarding_success = bool(forwarded_to)
+
+                # Add to forwarding details and update action tracking based on forwarding
+                if forwarding_success:
+                    self.summary['emails_forwarded'] += len(forwarded_to)
+                    forwarding_details['forwarded_to'] = forwarded_to
+                    self.summary['forwarding_details'].append(forwarding_details)
+                    email_had_action = True
+                    self.summary['actionable_emails'] += 1
+
+                # Update category stats only for actionable emails
+                if email_had_action:
+                    self.summary['category_stats'][primary_category] += 1
+
+                # Mark as read if forwarding was successful or no targets
+                if forwarding_success or not forward_indexes:
+                    pending_marks.append(message_id)
+
+            if pending_marks:
+                self.gmail.mark_as_read_bulk(pending_marks)
+
             # Generate and send reports
             self.generate_and_send_reports()
             
         except Exception as e:
             self.logger.error(f"Error in process_emails: {str(e)}")
 
+    def _create_calendar_reminder(self, email_data: Dict[str, Any], classification: Dict[str, Any],
+                                  category: str, calendar_settings: Dict[str, Any]) -> Optional[str]:
+        """Analyze an email with AI and create its calendar reminder, returning the event ID"""
+        try:
+            # Process with AI to get additional insights
+            ai_result = self.process_email_with_ai(email_data)
+            
+            # Ensure ai_analysis is a dictionary
+            if isinstance(ai_result.get('ai_analysis'), str):
+                try:
+                    ai_result['ai_analysis'] = json.loads(ai_result['ai_analysis'])
+                except:
+                    ai_result['ai_analysis'] = {
+                        'action_items': classification.get('action_items', []),
+                        'key_points': classification.get('key_points', []),
+                        'priority': classification.get('priority', 'normal')
+                    }
+
+            return self.calendar.create_reminder(
+                email_data=ai_result,
+                category=category,
+                calendar_settings=calendar_settings
+            )
+        except Exception as e:
+            self.logger.error(f"Error creating calendar reminder: {str(e)}")
+            return None
+
     def process_email_with_ai(self, email_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process email content using AI"""
         try:
@@ -275,7 +380,8 @@ class EmailProcessor:
             Note: Please provide your response without any markdown formatting or code block indicators.
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = create_chat_completion(
+                self.openai_client,
                 model="gpt-3.5-turbo",
                 messages=[{"role": "user", "content": prompt}]
             )
@@ -360,7 +466,8 @@ class EmailProcessor:
             Format the response in HTML with appropriate styling.
             """
             
-            response = self.openai_client.chat.completions.create(
+            response = create_chat_completion(
+                self.openai_client,
                 model=self.config.OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a professional email assistant generating a report introduction."},
@@ -427,7 +534,8 @@ class EmailProcessor:
             Format the response in HTML with appropriate styling for a email report.
             """
 
-            response = self.openai_client.chat.completions.create(
+            response = create_chat_completion(
+                self.openai_client,
                 model=self.config.OPENAI_MODEL,
                 messages=[
                     {"role": "system", "content": "You are a professional email assistant creating an action items summary."},
@@ -456,8 +564,12 @@ class EmailProcessor:
     def _generate_report_html(self) -> str:
         """Generate HTML report"""
         try:
-            introduction = self._generate_introduction()
-            action_summary = self._generate_action_items_summary()  # New action items summary
+            # The two LLM calls are independent, so wait on them together
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                introduction_future = executor.submit(self._generate_introduction)
+                action_summary_future = executor.submit(self._generate_action_items_summary)
+                introduction = introduction_future.result()
+                action_summary = action_summary_future.result()  # New action items summary
             category_stats = self._format_category_stats()
             forwarding_details = self._format_forwarding_details()
             calendar_events = self._format_calendar_events()
@@ -476,64 +588,17 @@ class EmailProcessor:
                 <p>Generated using InboxIQ - Intelligent Email Management System</p>
             </div>"""
             
-            return f"""
-            <html>
-            <head>
-                <style>
-                    body {{
-                        font-family: Arial, sans-serif;
-                        line-height: 1.6;
-                        color: #333;
-                        max-width: 800px;
-                        margin: 0 auto;
-                        padding: 20px;
-                    }}
-                    .section {{
-                        margin: 20px 0;
-                        padding: 15px;
-                        background-color: #fff;
-                        border-radius: 5px;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                    }}
-                    h2 {{
-                        color: #2c3e50;
-                        margin-top: 0;
-                    }}
-                    .stats-table {{
-                        width: 100%;
-                        border-collapse: collapse;
-                    }}
-                    .stats-table th, .stats-table td {{
-                        padding: 12px;
-                        text-align: left;
-                        border-bottom: 1px solid #ddd;
-                    }}
-                    .stats-table th {{
-                        background-color: #f8f9fa;
-                        font-weight: bold;
-                    }}
-                    .priority-high {{
-                        color: #e74c3c;
-                    }}
-                    .priority-medium {{
-                        color: #f39c12;
-                    }}
-                    .priority-low {{
-                        color: #27ae60;
-                    }}
-                </style>
-            </head>
-            <body>
-                {introduction}
-                {action_summary}
-                {category_stats}
-                {forwarding_details}
-                {calendar_events}
-                {action_items}
-                {disclaimer}
-            </body>
-            </html>
-            """
+            return '\n'.join([
+                REPORT_HTML_HEAD,
+                introduction,
+                action_summary,
+                category_stats,
+                forwarding_details,
+                calendar_events,
+                action_items,
+                disclaimer,
+                REPORT_HTML_FOOT
+            ])
         except Exception as e:
             self.logger.error(f"Error generating HTML report: {str(e)}")
             return f"""
@@ -550,30 +615,18 @@ class EmailProcessor:
         if not self.summary['category_stats']:
             return ""
             
-        stats_html = """
-        <div class="section">
-            <h2>Category Statistics (Actionable Emails)</h2>
-            <table class="stats-table">
-                <tr>
-                    <th>Category</th>
-                    <th>Count</th>
-                </tr>
-        """
+        stats = [
+            '<div class="section">',
+            '<h2>Category Statistics (Actionable Emails)</h2>',
+            '<table class="stats-table">',
+            '<tr><th>Category</th><th>Count</th></tr>'
+        ]
         
         for category, count in self.summary['category_stats'].items():
-            stats_html += f"""
-                <tr>
-                    <td>{category}</td>
-                    <td>{count}</td>
-                </tr>
-            """
+            stats.append(f"<tr><td>{html.escape(str(category))}</td><td>{html.escape(str(count))}</td></tr>")
             
-        stats_html += """
-            </table>
-        </div>
-        """
-        
-        return stats_html
+        stats.extend(['</table>', '</div>'])
+        return '\n'.join(stats)
 
     def _format_forwarding_details(self) -> str:
         """Format forwarding details section of the report"""
@@ -594,13 +647,13 @@ class EmailProcessor:
         
         for detail in self.summary['forwarding_details']:
             cc_badge = ' <span style="color: #e74c3c; font-weight: bold;">[CC]</span>' if detail.get('cc_recipient', False) else ''
-            categories = ', '.join(detail.get('categories', []))
-            forwarded_to = ', '.join(detail.get('forwarded_to', []))
+            categories = html.escape(', '.join(map(str, detail.get('categories', []))))
+            forwarded_to = html.escape(', '.join(map(str, detail.get('forwarded_to', []))))
             
             details.append(f"""
                 <tr style="border-bottom: 1px solid #ddd;">
-                    <td style="padding: 10px;">{detail['subject']}{cc_badge}</td>
-                    <td style="padding: 10px;">{detail['from']}</td>
+                    <td style="padding: 10px;">{html.escape(detail['subject'])}{cc_badge}</td>
+                    <td style="padding: 10px;">{html.escape(detail['from'])}</td>
                     <td style="padding: 10px; text-transform: capitalize;">{categories}</td>
                     <td style="padding: 10px;">{forwarded_to}</td>
                 </tr>
@@ -627,22 +680,17 @@ class EmailProcessor:
         ]
         
         for event in self.summary['calendar_events']:
-            priority_color = {
-                'high': '#e74c3c',
-                'urgent': '#c0392b',
-                'normal': '#3498db',
-                'low': '#7f8c8d'
-            }.get(event.get('priority', 'normal'), '#3498db')
+            priority_color = PRIORITY_COLORS.get(event.get('priority', 'normal'), '#3498db')
             
             events.append(f"""
                 <tr style="border-bottom: 1px solid #ddd;">
-                    <td style="padding: 10px;">{event['subject']}</td>
-                    <td style="padding: 10px; text-transform: uppercase;">{event['category']}</td>
+                    <td style="padding: 10px;">{html.escape(event['subject'])}</td>
+                    <td style="padding: 10px; text-transform: uppercase;">{html.escape(str(event['category']))}</td>
                     <td style="padding: 10px; text-align: center;">
-                        <span style="color: {priority_color}; font-weight: bold;">{event['priority'].upper()}</span>
+                        <span style="color: {priority_color}; font-weight: bold;">{html.escape(event['priority'].upper())}</span>
                     </td>
                     <td style="padding: 10px; text-align: center;">
-                        <a href="{event['event_link']}" style="color: #3498db; text-decoration: none;">View in Calendar →</a>
+                        <a href="{html.escape(str(event['event_link']))}" style="color: #3498db; text-decoration: none;">View in Calendar →</a>
                     </td>
                 </tr>
             """)
@@ -652,11 +700,6 @@ class EmailProcessor:
 
     def _format_action_items(self) -> str:
         """Format action items section of the report"""
-        action_items = []
-        for detail in self.summary['forwarding_details']:
-            if detail.get('action_items'):
-                action_items.extend(detail['action_items'])
-        
         if not self.summary.get('action_items'):
             return ""
             
@@ -670,12 +713,12 @@ class EmailProcessor:
             items.extend([
                 f"<li style='margin-bottom: 10px; padding-left: 20px; position: relative;'>",
                 f"<span style='position: absolute; left: 0; color: #d35400;'>•</span>",
-                f"<strong>From:</strong> {email_actions['sender']}",
-                f"<br><strong>Subject:</strong> {email_actions['subject']}",
+                f"<strong>From:</strong> {html.escape(email_actions['sender'])}",
+                f"<br><strong>Subject:</strong> {html.escape(email_actions['subject'])}",
                 "<br>Action Items:"
             ])
             for item in email_actions['items']:
-                items.append(f"<li style='margin-left: 20px;'>{item}</li>")
+                items.append(f"<li style='margin-left: 20px;'>{html.escape(str(item))}</li>")
             items.append("</li>")
         
         items.extend(['</ul>', '</div>'])
@@ -692,16 +735,14 @@ class EmailProcessor:
 
     def _clean_ai_response(self, text: str) -> str:
         """Clean up AI response by removing markdown and code block indicators"""
-        # Remove markdown code block indicators
-        text = re.sub(r'```\w*\n?', '', text)
-        # Remove trailing backticks
-        text = re.sub(r'```$', '', text)
+        # Remove markdown code block indicators, trailing ones included
+        text = CODE_FENCE_RE.sub('', text)
         # Remove html comments
-        text = re.sub(r'<!--.*?-->', '', text, flags=re.DOTALL)
+        text = HTML_COMMENT_RE.sub('', text)
         # Remove any remaining backticks
         text = text.replace('`', '')
         # Clean up multiple newlines
-        text = re.sub(r'\n{3,}', '\n\n', text)
+        text = EXTRA_NEWLINES_RE.sub('\n\n', text)
         return text.strip()
 
 def main():
@@ -720,14 +761,16 @@ def main():
     try:
         # Load credentials from token file
         if os.path.exists('token.json'):
+            # Parse the token once and build a single config shared by every component
             with open('token.json', 'r') as token:
-                creds_info = eval(token.read())
-                from google.oauth2.credentials import Credentials
-                creds = Credentials.from_authorized_user_info(creds_info, Config.from_env().GMAIL_SCOPES)
-                gmail_handler = GmailHandler(credentials=creds, config=Config.from_env())
-                processor = EmailProcessor(gmail_handler, Config.from_env())
-                processor.process_emails(max_emails=args.max_emails)  # Use the command line argument
-                processor.generate_and_send_reports()
+                creds_info, _ = parse_token_data(token.read())
+            from google.oauth2.credentials import Credentials
+            config = Config.from_env()
+            creds = Credentials.from_authorized_user_info(creds_info, config.GMAIL_SCOPES)
+            gmail_handler = GmailHandler(credentials=creds, config=config)
+            processor = EmailProcessor(gmail_handler, config)
+            processor.process_emails(max_emails=args.max_emails)  # Use the command line argument
+            processor.generate_and_send_reports()
                 
         else:
             raise ValueError("No token.json found. Please authenticate first.")
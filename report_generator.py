@@ -3,6 +3,7 @@ from datetime import datetime, timedelta
 from typing import Dict, Any, List
 from tabulate import tabulate
 from config import Config
+from utils import create_chat_completion
 import logging
 
 class ReportGenerator:
@@ -499,7 +500,8 @@ class ReportGenerator:
         """
 
         try:
-            response = openai_client.chat.completions.create(
+            response = create_chat_completion(
+                openai_client,
                 model=os.getenv('OPENAI_MODEL', 'gpt-4'),
                 messages=[{
                     'role': 'system',
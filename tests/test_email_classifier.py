@@ -123,6 +123,44 @@ class TestEmailClassifier(unittest.TestCase):
             "Expected 'Atlas' in project names"
         )
 
+    @patch('email_classifier.create_chat_completion')
+    def test_identical_email_classified_once(self, mock_completion):
+        """Test that a recurring email reuses the cached classification"""
+        mock_completion.return_value.choices[0].message.content = '{"categories": ["sales"]}'
+        email_data = dict(self.test_emails['sales'], sender='lead@example.com')
+
+        first = self.classifier.classify_email(email_data)
+        second = self.classifier.classify_email(dict(email_data))
+        rewrapped = self.classifier.classify_email(dict(
+            email_data,
+            sender='Lead <Lead@Example.com>',
+            body=email_data['body'].replace(' ', '\n', 3)
+        ))
+
+        self.assertEqual(first, second)
+        self.assertEqual(first, rewrapped)
+        self.assertEqual(first['categories'], ['sales'])
+        mock_completion.assert_called_once()
+
+    @patch('email_classifier.create_chat_completion')
+    def test_batch_classification_shares_one_request(self, mock_completion):
+        """Test that several emails are classified in one request, in input order"""
+        mock_completion.return_value.choices[0].message.content = (
+            '{"results": [{"id": 1, "categories": ["critical"], "priority": "urgent"},'
+            ' {"id": 0, "categories": ["sales"]}]}'
+        )
+        emails = [
+            dict(self.test_emails['sales'], sender='lead@example.com'),
+            dict(self.test_emails['urgent'], sender='ops@example.com'),
+        ]
+
+        results = self.classifier.classify_emails(emails)
+
+        mock_completion.assert_called_once()
+        self.assertEqual([r['categories'] for r in results], [['sales'], ['critical']])
+        self.assertEqual(results[0]['priority'], 'normal')
+        self.assertEqual(results[1]['priority'], 'urgent')
+
     def test_target_email_resolution(self):
         """Test getting target emails based on classification"""
         # Create a classification with known configured categories
@@ -148,6 +186,30 @@ class TestEmailClassifier(unittest.TestCase):
         for target in targets:
             self.assertEqual(target['priority'], 'urgent')
 
+    def test_target_routing_is_resolved_once(self):
+        """Test that repeated routing lookups reuse the resolved targets"""
+        config = MagicMock()
+        config.EMAIL_CATEGORIES = {
+            'support': {'target_emails': ['help@test.com', 'ops@test.com']},
+            'invoice': {'target_emails': ['ops@test.com', 'billing@test.com']},
+            'vendor': {'direct_forward': True, 'from_emails': ['@vendor.com'], 'target_emails': ['ap@test.com']}
+        }
+        classifier = EmailClassifier(config)
+        classification = {'categories': ['support', 'invoice'], 'priority': 'urgent'}
+
+        with patch.object(classifier, '_enabled_categories', wraps=classifier._enabled_categories) as enabled:
+            first = classifier.get_target_emails(classification)
+            second = classifier.get_target_emails(classification)
+            self.assertEqual(enabled.call_count, 1)
+
+        self.assertEqual(first, second)
+        self.assertEqual([t['email'] for t in first], ['help@test.com', 'ops@test.com', 'billing@test.com'])
+        self.assertTrue(all(t['priority'] == 'urgent' for t in first))
+        self.assertEqual(
+            classifier.get_target_emails(classification, 'Bills@Vendor.com'),
+            [{'email': 'ap@test.com', 'priority': 'high'}]
+        )
+
     def test_important_marking(self):
         """Test conditions for marking email as important"""
         # Test urgent priority
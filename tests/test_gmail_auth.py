@@ -2,9 +2,12 @@ import unittest
 from unittest.mock import patch, MagicMock
 import os
 import sys
+import json
+import tempfile
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from gmail_auth import GmailAuthenticator
+import gmail_auth
+from gmail_auth import GmailAuthenticator, parse_token_data
 
 class TestGmailAuthenticator(unittest.TestCase):
     def setUp(self):
@@ -26,5 +29,90 @@ class TestGmailAuthenticator(unittest.TestCase):
         self.assertEqual(auth_url, 'http://test-auth-url')
         mock_flow.from_client_config.assert_called_once()
 
+class TestParseTokenData(unittest.TestCase):
+    def test_parses_json(self):
+        data, is_legacy = parse_token_data('{"token": "abc", "refresh_token": null}')
+        self.assertEqual(data, {'token': 'abc', 'refresh_token': None})
+        self.assertFalse(is_legacy)
+
+    def test_parses_legacy_dict_repr(self):
+        data, is_legacy = parse_token_data("{'token': 'abc', 'refresh_token': None}")
+        self.assertEqual(data, {'token': 'abc', 'refresh_token': None})
+        self.assertTrue(is_legacy)
+
+    def test_rejects_code(self):
+        with self.assertRaises(ValueError):
+            parse_token_data("__import__('os').getcwd()")
+
+class TestCredentialsCache(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.chdir(self.tmpdir.name)
+        with open('token.json', 'w') as f:
+            json.dump({
+                'token': 'access',
+                'refresh_token': 'refresh',
+                'token_uri': 'https://oauth2.googleapis.com/token',
+                'client_id': 'client',
+                'client_secret': 'secret'
+            }, f)
+        gmail_auth._creds_for.cache_clear()
+        with patch.object(GmailAuthenticator, '_setup_oauth_config'):
+            self.authenticator = GmailAuthenticator(['https://www.googleapis.com/auth/gmail.readonly'])
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def test_reuses_parsed_credentials(self):
+        first = self.authenticator._load_credentials_from_token()
+        with patch('gmail_auth.parse_token_data') as mock_parse:
+            second = self.authenticator._load_credentials_from_token()
+        mock_parse.assert_not_called()
+        self.assertIs(first, second)
+
+    def test_reloads_after_write(self):
+        first = self.authenticator._load_credentials_from_token()
+        self.authenticator._write_token({
+            'token': 'new-access',
+            'refresh_token': 'refresh',
+            'token_uri': 'https://oauth2.googleapis.com/token',
+            'client_id': 'client',
+            'client_secret': 'secret'
+        })
+        second = self.authenticator._load_credentials_from_token()
+        self.assertIsNot(first, second)
+        self.assertEqual(second.token, 'new-access')
+
+    def test_migrates_legacy_token_file(self):
+        with open('token.json', 'w') as f:
+            f.write(str({
+                'token': 'legacy',
+                'refresh_token': 'refresh',
+                'token_uri': 'https://oauth2.googleapis.com/token',
+                'client_id': 'client',
+                'client_secret': 'secret'
+            }))
+        creds = self.authenticator._load_credentials_from_token()
+        self.assertEqual(creds.token, 'legacy')
+        with open('token.json') as f:
+            self.assertEqual(json.load(f)['token'], 'legacy')
+
+    def test_get_credentials_skips_disk_while_valid(self):
+        creds = MagicMock(valid=True)
+        with patch.object(self.authenticator, '_load_credentials_from_token', return_value=creds) as mock_load:
+            self.assertIs(self.authenticator.get_credentials(), creds)
+            self.assertIs(self.authenticator.get_credentials(), creds)
+        mock_load.assert_called_once()
+
+    def test_shares_credentials_across_authenticators(self):
+        with patch.object(GmailAuthenticator, '_setup_oauth_config'):
+            other = GmailAuthenticator(['https://www.googleapis.com/auth/gmail.readonly'])
+        self.assertIs(
+            self.authenticator._load_credentials_from_token(),
+            other._load_credentials_from_token()
+        )
+
 if __name__ == '__main__':
     unittest.main()
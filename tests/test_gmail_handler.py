@@ -0,0 +1,405 @@
+import unittest
+from collections import OrderedDict
+from unittest.mock import patch, MagicMock
+import email
+import email.policy
+import logging
+import os
+import sys
+import threading
+import httplib2
+from googleapiclient.errors import HttpError
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gmail_handler import (
+    GmailHandler, LIST_METADATA_HEADERS, LIST_METADATA_FIELDS, LIST_BODY_FIELDS,
+    _decode_body, _extract_all, _extract_headers, _truncate, base64
+)
+
+class FakeBatch:
+    """Minimal stand-in for BatchHttpRequest that answers every request"""
+
+    def __init__(self, callback, responses, batches):
+        self.callback = callback
+        self.responses = responses
+        self.requests = []
+        batches.append(self)
+
+    def add(self, request, request_id=None):
+        self.requests.append(request_id)
+
+    def execute(self, http=None):
+        self.http = http
+        for request_id in self.requests:
+            response = self.responses.get(request_id)
+            if isinstance(response, list):
+                # A sequence of answers, one per batch the request is sent in
+                response = response.pop(0)
+            if isinstance(response, Exception):
+                self.callback(request_id, None, response)
+            else:
+                self.callback(request_id, response, None)
+
+def make_handler(responses):
+    """Create a GmailHandler wired to a mocked Gmail service"""
+    handler = GmailHandler.__new__(GmailHandler)
+    handler.logger = logging.getLogger(__name__)
+    handler.config = MagicMock()
+    handler.email = 'me@example.com'
+    handler._label_cache = None
+    handler._label_lock = threading.Lock()
+    handler._message_cache = OrderedDict()
+    handler._owner_thread = threading.get_ident()
+    handler._thread_state = threading.local()
+    handler.batches = []
+    handler._new_authorized_http = MagicMock(side_effect=lambda: object())
+    handler.service = MagicMock()
+    handler.service.new_batch_http_request.side_effect = (
+        lambda callback=None: FakeBatch(callback, responses, handler.batches)
+    )
+    return handler
+
+def make_message(msg_id, subject):
+    return {
+        'id': msg_id,
+        'payload': {
+            'headers': [
+                {'name': 'Subject', 'value': subject},
+                {'name': 'From', 'value': 'sender@example.com'},
+                {'name': 'To', 'value': 'me@example.com'},
+            ],
+            'body': {}
+        }
+    }
+
+class TestBatchGetMessages(unittest.TestCase):
+    def test_chunks_requests_to_batch_limit(self):
+        ids = [f'id{i}' for i in range(150)]
+        handler = make_handler({msg_id: {'id': msg_id} for msg_id in ids})
+
+        results = handler._batch_get_messages(ids)
+
+        self.assertEqual(len(results), 150)
+        self.assertEqual(sorted(len(batch.requests) for batch in handler.batches), [50, 50, 50])
+        # Concurrent batches must not share an HTTP connection
+        self.assertIsNot(handler.batches[0].http, handler.batches[1].http)
+
+    def test_skips_failed_messages(self):
+        handler = make_handler({'a': {'id': 'a'}, 'b': RuntimeError('boom')})
+
+        results = handler._batch_get_messages(['a', 'b'])
+
+        self.assertEqual(list(results), ['a'])
+
+    def test_get_unread_emails_preserves_list_order(self):
+        handler = make_handler({
+            'b': make_message('b', 'Second'),
+            'a': make_message('a', 'First'),
+        })
+        handler.list_messages = MagicMock(return_value=[
+            {'id': 'a', 'threadId': 't1'},
+            {'id': 'b', 'threadId': 't2'},
+        ])
+
+        emails = handler.get_unread_emails()
+
+        self.assertEqual([email['subject'] for email in emails], ['First', 'Second'])
+        self.assertTrue(emails[0]['is_to'])
+        self.assertNotIn('body', emails[0])
+
+    def test_list_views_request_metadata_only(self):
+        handler = make_handler({'a': make_message('a', 'First')})
+        handler.list_messages = MagicMock(return_value=[{'id': 'a', 'threadId': 't1'}])
+
+        handler.get_unread_emails()
+        handler.service.users().messages().get.assert_called_with(
+            userId='me', id='a', format='metadata', metadataHeaders=LIST_METADATA_HEADERS,
+            fields=LIST_METADATA_FIELDS
+        )
+
+        emails = handler.get_unread_emails(include_body=True)
+        handler.service.users().messages().get.assert_called_with(
+            userId='me', id='a', format='full', metadataHeaders=None, fields=LIST_BODY_FIELDS
+        )
+        self.assertIn('body', emails[0])
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'')
+
+class TestBatchItemRetries(unittest.TestCase):
+    @patch('gmail_handler.time.sleep')
+    def test_retryable_item_failures_are_sent_again(self, mock_sleep):
+        handler = make_handler({'a': {}, 'b': [http_error(429), {}], 'c': http_error(404)})
+
+        self.assertEqual(handler.mark_as_read_bulk(['a', 'b', 'c']), ['a', 'b'])
+        self.assertEqual([batch.requests for batch in handler.batches], [['a', 'b', 'c'], ['b']])
+
+    @patch('gmail_handler.time.sleep')
+    def test_failed_sends_are_not_sent_again(self, mock_sleep):
+        handler = make_handler({'0': http_error(429)})
+
+        results = handler.forward_emails([{'to_email': 'one@example.com', 'subject': 'FWD: A', 'body': 'a'}])
+
+        self.assertEqual(results, [False])
+        self.assertEqual(len(handler.batches), 1)
+
+    @patch('utils.time.sleep')
+    def test_send_batch_not_retried_on_server_errors(self, mock_sleep):
+        handler = make_handler({})
+        batch = MagicMock()
+        batch.execute.side_effect = http_error(503)
+        handler.service.new_batch_http_request.side_effect = lambda callback=None: batch
+
+        results = handler.forward_emails([{'to_email': 'one@example.com', 'subject': 'FWD: A', 'body': 'a'}])
+
+        self.assertEqual(results, [False])
+        batch.execute.assert_called_once()
+
+class TestExecWithRetry(unittest.TestCase):
+    @patch('utils.time.sleep')
+    def test_retries_rate_limit_errors(self, mock_sleep):
+        handler = make_handler({})
+        request = MagicMock()
+        request.execute.side_effect = [http_error(429), http_error(503), {'id': 'a'}]
+
+        self.assertEqual(handler._exec_with_retry(request), {'id': 'a'})
+        self.assertEqual(request.execute.call_count, 3)
+
+    @patch('utils.time.sleep')
+    def test_does_not_retry_client_errors(self, mock_sleep):
+        handler = make_handler({})
+        request = MagicMock()
+        request.execute.side_effect = http_error(404)
+
+        with self.assertRaises(HttpError):
+            handler._exec_with_retry(request)
+        request.execute.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch('utils.time.sleep')
+    def test_sends_are_not_retried_on_server_errors(self, mock_sleep):
+        handler = make_handler({})
+        send = handler.service.users().messages().send().execute
+        send.side_effect = [http_error(503), {'id': 'sent'}]
+
+        self.assertFalse(handler.send_message({'raw': 'abc'}))
+        send.assert_called_once()
+
+        send.side_effect = [http_error(429), {'id': 'sent'}]
+        self.assertTrue(handler.send_message({'raw': 'abc'}))
+
+    def test_other_threads_use_their_own_connection(self):
+        handler = make_handler({})
+        request = MagicMock()
+        request.execute.return_value = {'id': 'a'}
+
+        handler._exec_with_retry(request)
+        self.assertIsNone(request.execute.call_args.kwargs['http'])
+
+        worker = threading.Thread(target=lambda: (handler._exec_with_retry(request), handler._exec_with_retry(request)))
+        worker.start()
+        worker.join()
+        worker_https = [call.kwargs['http'] for call in request.execute.call_args_list[1:]]
+        self.assertIsNotNone(worker_https[0])
+        self.assertIs(worker_https[0], worker_https[1])
+
+class TestMessageCache(unittest.TestCase):
+    def test_get_message_reuses_cached_copy_until_modified(self):
+        handler = make_handler({})
+        get = handler.service.users().messages().get
+        get().execute.return_value = {'id': 'a'}
+        get.reset_mock()
+
+        handler.get_message('a')
+        handler.get_message('a')
+        self.assertEqual(get.call_count, 1)
+
+        handler.mark_as_read('a')
+        handler.get_message('a')
+        self.assertEqual(get.call_count, 2)
+
+class TestHistory(unittest.TestCase):
+    def test_has_new_messages(self):
+        handler = make_handler({})
+        history = handler.service.users().history().list().execute
+
+        history.return_value = {}
+        self.assertFalse(handler.has_new_messages('100'))
+
+        history.return_value = {'history': [{'id': '101'}]}
+        self.assertTrue(handler.has_new_messages('100'))
+        self.assertEqual(handler.service.users().history().list.call_args.kwargs['labelId'], 'INBOX')
+
+        history.side_effect = http_error(404)
+        self.assertIsNone(handler.has_new_messages('1'))
+
+class TestLabelCache(unittest.TestCase):
+    def test_labels_listed_once_per_handler(self):
+        handler = make_handler({})
+        labels = handler.service.users().labels()
+        labels.list().execute.return_value = {'labels': [{'name': 'Invoices', 'id': 'Label_1'}]}
+        labels.create().execute.return_value = {'id': 'Label_2'}
+        labels.list.reset_mock()
+        labels.create.reset_mock()
+
+        self.assertEqual(handler._create_label('invoices'), 'Label_1')
+        self.assertEqual(handler._create_label('Receipts'), 'Label_2')
+        self.assertEqual(handler._create_label('receipts'), 'Label_2')
+
+        labels.list.assert_called_once()
+        labels.create.assert_called_once()
+
+    def test_missing_label_invalidates_cache(self):
+        handler = make_handler({})
+        handler._label_cache = {'invoices': 'Label_1'}
+        handler.service.users().messages().modify().execute.side_effect = http_error(404)
+
+        self.assertFalse(handler.add_label('a', 'Invoices'))
+        self.assertIsNone(handler._label_cache)
+
+class TestExtractAll(unittest.TestCase):
+    def test_single_pass_returns_headers_body_and_attachments(self):
+        payload = {
+            'headers': [{'name': 'Subject', 'value': 'Invoice'}],
+            'parts': [
+                {'mimeType': 'text/plain', 'body': {'data': base64.urlsafe_b64encode(b'Please pay').decode()}},
+                {'mimeType': 'text/plain', 'body': {'data': base64.urlsafe_b64encode(b'Second').decode()}},
+                {'mimeType': 'application/pdf', 'filename': 'invoice.pdf', 'body': {'attachmentId': 'att1'}},
+            ]
+        }
+
+        headers, body, attachments = _extract_all(payload)
+
+        self.assertEqual(headers['subject'], 'Invoice')
+        self.assertEqual(body, 'Please pay')
+        self.assertEqual(attachments, [
+            {'filename': 'invoice.pdf', 'attachment_id': 'att1', 'mime_type': 'application/pdf'}
+        ])
+
+    def test_headers_keep_only_wanted_names_case_insensitively(self):
+        headers = _extract_headers({'headers': [
+            {'name': 'Received', 'value': 'by mx.example.com'},
+            {'name': 'SUBJECT', 'value': 'Invoice'},
+            {'name': 'from', 'value': 'vendor@example.com'},
+            {'name': 'CC', 'value': 'me@example.com'},
+        ]})
+
+        self.assertEqual(headers, {'subject': 'Invoice', 'from': 'vendor@example.com', 'cc': 'me@example.com'})
+
+    def test_preview_decoding_matches_full_decode(self):
+        for text in ['a' * 2000, 'é' * 2000, '😀' * 600, 'x' * 501, 'short']:
+            data = base64.urlsafe_b64encode(text.encode('utf-8')).decode()
+            self.assertEqual(_truncate(_decode_body(data, 500)), _truncate(text))
+
+    def test_decodes_unpadded_and_malformed_bodies(self):
+        self.assertEqual(_decode_body('aGk'), 'hi')
+        self.assertEqual(_decode_body(base64.urlsafe_b64encode(b'ok \xff').decode()), 'ok \ufffd')
+
+class TestDownloadAttachments(unittest.TestCase):
+    def test_decodes_attachments_keyed_by_id(self):
+        handler = make_handler({
+            'att1': {'data': base64.urlsafe_b64encode(b'first').decode()},
+            'att2': RuntimeError('gone'),
+        })
+
+        contents = handler.download_attachments('msg', ['att1', 'att2'])
+
+        self.assertEqual(contents, {'att1': b'first', 'att2': None})
+        self.assertEqual(len(handler.batches), 1)
+
+    def test_bulk_download_spans_emails_in_order(self):
+        handler = make_handler({
+            '0': {'data': base64.urlsafe_b64encode(b'first').decode()},
+            '1': RuntimeError('gone'),
+            '2': {'data': base64.urlsafe_b64encode(b'third').decode()},
+        })
+
+        contents = handler.download_attachments_bulk([('m1', 'att'), ('m2', 'att'), ('m3', 'att')])
+
+        self.assertEqual(contents, [b'first', None, b'third'])
+        self.assertEqual(len(handler.batches), 1)
+
+class TestForwardEmail(unittest.TestCase):
+    def test_forward_includes_cc_and_attachments(self):
+        handler = make_handler({})
+
+        self.assertTrue(handler.forward_email(
+            'to@example.com', 'Invoice', 'See attached',
+            attachments=[{'filename': 'invoice.pdf', 'content': b'%PDF-1.4'}],
+            cc_list=['cc@example.com']
+        ))
+
+        raw = handler.service.users().messages().send.call_args.kwargs['body']['raw']
+        message = email.message_from_bytes(base64.urlsafe_b64decode(raw))
+        self.assertEqual(message['To'], 'to@example.com')
+        self.assertEqual(message['Cc'], 'cc@example.com')
+        attachment = message.get_payload()[1]
+        self.assertEqual(attachment.get_filename(), 'invoice.pdf')
+        self.assertEqual(attachment.get_payload(decode=True), b'%PDF-1.4')
+
+    def test_forwards_and_marks_share_batches(self):
+        handler = make_handler({'0': {'id': 'sent'}, '1': Exception('quota'), 'a': {}, 'b': {}})
+
+        results = handler.forward_emails([
+            {'to_email': 'one@example.com', 'subject': 'FWD: A', 'body': 'a'},
+            {'to_email': 'two@example.com', 'subject': 'FWD: A', 'body': 'a'},
+        ])
+        marked = handler.mark_as_read_bulk(['a', 'b'])
+
+        self.assertEqual(results, [True, False])
+        self.assertEqual(marked, ['a', 'b'])
+        self.assertEqual([batch.requests for batch in handler.batches], [['0', '1'], ['a', 'b']])
+
+    def test_forward_message_attaches_original(self):
+        handler = make_handler({})
+        original = b'From: vendor@example.com\r\nSubject: Invoice 42\r\n\r\nPlease pay\r\n'
+        handler.service.users().messages().get().execute.return_value = {
+            'raw': base64.urlsafe_b64encode(original).decode()
+        }
+
+        self.assertTrue(handler.forward_message('msg', 'to@example.com', 'FWD: Invoice 42', 'See attached'))
+
+        raw = handler.service.users().messages().send.call_args.kwargs['body']['raw']
+        message = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+        forwarded = message.get_payload()[1]
+        self.assertEqual(forwarded.get_content_type(), 'message/rfc822')
+        self.assertEqual(forwarded.get_content()['Subject'], 'Invoice 42')
+
+class TestCreateMessage(unittest.TestCase):
+    def test_builds_html_message_with_encoded_subject(self):
+        handler = make_handler({})
+
+        raw = handler.create_message('me@example.com', 'you@example.com', 'Résumé du jour', '<p>Héllo</p>')['raw']
+
+        message = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+        self.assertEqual(message['Subject'], 'Résumé du jour')
+        self.assertEqual(message['To'], 'you@example.com')
+        self.assertEqual(message.get_content_type(), 'text/html')
+        self.assertEqual(message.get_content(), '<p>Héllo</p>')
+
+    def test_encodes_non_ascii_names_and_folds_address_headers(self):
+        handler = make_handler({})
+
+        raw = handler.create_message('José Núñez <me@example.com>', 'you@example.com\r\nBcc: x@example.com',
+                                     'Report', '<p>Hi</p>')['raw']
+
+        message = email.message_from_bytes(base64.urlsafe_b64decode(raw), policy=email.policy.default)
+        self.assertEqual(message['From'].addresses[0].display_name, 'José Núñez')
+        self.assertEqual(message['From'].addresses[0].addr_spec, 'me@example.com')
+        self.assertIsNone(message['Bcc'])
+
+    def test_folds_long_headers_with_crlf(self):
+        handler = make_handler({})
+        subjects = [' '.join(['Weekly report'] * 20), ' '.join(['Résumé hebdomadaire'] * 20)]
+
+        for subject in subjects:
+            raw = base64.urlsafe_b64decode(handler.create_message('me@example.com', 'you@example.com',
+                                                                  subject, '<p>Hi</p>')['raw'])
+            header_block = raw.split(b'\r\n\r\n', 1)[0]
+            self.assertNotIn(b'\n', header_block.replace(b'\r\n', b''))
+            self.assertTrue(all(len(line) <= 78 for line in header_block.split(b'\r\n')))
+            message = email.message_from_bytes(raw, policy=email.policy.default)
+            self.assertEqual(message['Subject'], subject)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import json
+import unittest
+from unittest.mock import patch
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from invoice_analyzer import InvoiceAnalyzer
+
+class TestInvoiceAnalyzer(unittest.TestCase):
+    def setUp(self):
+        with patch.dict(os.environ, {'OPENAI_API_KEY': 'test'}):
+            self.analyzer = InvoiceAnalyzer()
+
+    @patch('invoice_analyzer.create_chat_completion')
+    def test_skips_openai_without_invoice_keywords(self, mock_completion):
+        result = self.analyzer.analyze_content("Hi team, see you at the offsite next week!")
+
+        self.assertFalse(result['is_invoice'])
+        self.assertEqual(result['confidence'], 0.0)
+        mock_completion.assert_not_called()
+
+    @patch('invoice_analyzer.create_chat_completion', side_effect=RuntimeError('offline'))
+    def test_keyword_text_reaches_analysis(self, mock_completion):
+        result = self.analyzer.analyze_content("Invoice #INV-42\nTotal: $120.00")
+
+        mock_completion.assert_called_once()
+        self.assertEqual(result['invoice_data']['total_amount']['amount'], 120.0)
+
+    @patch('invoice_analyzer.create_chat_completion')
+    def test_identical_content_analyzed_once(self, mock_completion):
+        message = mock_completion.return_value.choices[0].message
+        message.content = '{"is_invoice": true, "confidence": 0.9, "invoice_data": {}}'
+        text = "Invoice #INV-42\nTotal: $120.00"
+
+        first = self.analyzer.analyze_content(text)
+        second = self.analyzer.analyze_content(text)
+
+        self.assertEqual(first, second)
+        mock_completion.assert_called_once()
+
+    @patch('invoice_analyzer.create_chat_completion')
+    def test_low_confidence_analysis_not_cached(self, mock_completion):
+        message = mock_completion.return_value.choices[0].message
+        message.content = '{"is_invoice": false, "confidence": 0.1, "invoice_data": {}}'
+
+        self.analyzer.analyze_content("Your order has shipped")
+        self.analyzer.analyze_content("Your order has shipped")
+
+        self.assertEqual(mock_completion.call_count, 2)
+
+    @patch('invoice_analyzer.create_chat_completion')
+    def test_batch_packs_texts_into_one_request(self, mock_completion):
+        mock_completion.return_value.choices[0].message.content = json.dumps({'results': [
+            {'id': 1, 'is_invoice': False, 'confidence': 0.8, 'invoice_data': {}},
+            {'id': 0, 'is_invoice': True, 'confidence': 0.9, 'invoice_data': {'invoice_number': 'A1'}},
+        ]})
+
+        results = self.analyzer.analyze_content_batch([
+            "Invoice A1 total: $10", "Lunch on Friday?", "Order confirmation"
+        ])
+
+        mock_completion.assert_called_once()
+        self.assertEqual(results[0]['invoice_data'], {'invoice_number': 'A1'})
+        self.assertEqual(results[1]['confidence'], 0.0)
+        self.assertFalse(results[2]['is_invoice'])
+
+    def test_basic_analysis_extracts_invoice_number(self):
+        result = self.analyzer._basic_invoice_analysis("Invoice No. INV-2024-001\nTotal: $250.00")
+
+        self.assertEqual(result['invoice_data']['invoice_number'], 'inv-2024-001')
+        self.assertEqual(result['invoice_data']['total_amount'], {'amount': 250.0, 'currency': 'USD'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+from unittest.mock import patch, MagicMock
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json
+import httplib2
+import openai
+from googleapiclient.errors import HttpError
+from utils import (
+    TokenBucket, CircuitBreaker, CircuitOpenError, create_chat_completion, execute_google_request,
+    extract_pdf_text
+)
+
+class TestTokenBucket(unittest.TestCase):
+    def test_acquire_within_capacity_does_not_block(self):
+        bucket = TokenBucket(rate=5, period=60)
+        with patch('utils.time.sleep') as mock_sleep:
+            for _ in range(5):
+                bucket.acquire()
+        mock_sleep.assert_not_called()
+
+    def test_acquire_blocks_when_empty(self):
+        bucket = TokenBucket(rate=1, period=60)
+        bucket.acquire()
+        with patch('utils.time.sleep', side_effect=lambda s: setattr(bucket, 'tokens', 1)) as mock_sleep:
+            bucket.acquire()
+        mock_sleep.assert_called_once()
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+        failing = MagicMock(side_effect=ValueError("boom"))
+
+        for _ in range(2):
+            with self.assertRaises(ValueError):
+                breaker.call(failing)
+
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(failing)
+        self.assertEqual(failing.call_count, 2)
+
+    def test_success_resets_failures(self):
+        breaker = CircuitBreaker(fail_max=2, reset_timeout=30)
+        with self.assertRaises(ValueError):
+            breaker.call(MagicMock(side_effect=ValueError("boom")))
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+        self.assertEqual(breaker.failures, 0)
+
+    def test_only_counted_errors_open_the_circuit(self):
+        breaker = CircuitBreaker(fail_max=1, reset_timeout=30, counted_errors=(ConnectionError,))
+        for _ in range(3):
+            with self.assertRaises(ValueError):
+                breaker.call(MagicMock(side_effect=ValueError("bad request")))
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+
+    def test_half_open_admits_a_single_trial(self):
+        breaker = CircuitBreaker(fail_max=1, reset_timeout=30)
+        with self.assertRaises(ValueError):
+            breaker.call(MagicMock(side_effect=ValueError("boom")))
+        breaker.opened_at -= 31
+
+        def trial():
+            # A concurrent caller is rejected while the trial runs
+            with self.assertRaises(CircuitOpenError):
+                breaker.call(lambda: 'ok')
+            return 'trial'
+
+        self.assertEqual(breaker.call(trial), 'trial')
+        self.assertIsNone(breaker.opened_at)
+        self.assertEqual(breaker.call(lambda: 'ok'), 'ok')
+
+class TestExecuteGoogleRequest(unittest.TestCase):
+    @patch('utils.time.sleep')
+    def test_waits_for_retry_after(self, mock_sleep):
+        request = MagicMock()
+        request.execute.side_effect = [
+            HttpError(httplib2.Response({'status': 429, 'retry-after': '7'}), b''),
+            {'id': 'a'}
+        ]
+
+        self.assertEqual(execute_google_request(request), {'id': 'a'})
+        mock_sleep.assert_called_once_with(7.0)
+
+    @patch('utils.time.sleep')
+    def test_gives_up_when_retry_after_is_too_long(self, mock_sleep):
+        request = MagicMock()
+        request.execute.side_effect = HttpError(httplib2.Response({'status': 429, 'retry-after': '3600'}), b'')
+
+        with self.assertRaises(HttpError):
+            execute_google_request(request)
+        request.execute.assert_called_once()
+        mock_sleep.assert_not_called()
+
+    @patch('utils.time.sleep')
+    def test_retries_rate_limited_forbidden_errors_only(self, mock_sleep):
+        content = json.dumps({'error': {'code': 403, 'message': 'Rate Limit Exceeded', 'errors': [{'reason': 'userRateLimitExceeded'}]}}).encode()
+        request = MagicMock()
+        request.execute.side_effect = [HttpError(httplib2.Response({'status': 403}), content), {'id': 'a'}]
+        self.assertEqual(execute_google_request(request), {'id': 'a'})
+
+        request.execute.side_effect = HttpError(httplib2.Response({'status': 403}), b'')
+        with self.assertRaises(HttpError):
+            execute_google_request(request)
+
+class TestExtractPdfText(unittest.TestCase):
+    def test_falls_back_to_pypdf2_when_pdfium_fails(self):
+        pdfium = MagicMock()
+        pdfium.PdfDocument.side_effect = ValueError("unsupported")
+        page = MagicMock()
+        page.extract_text.return_value = 'Invoice 42'
+
+        with patch('utils.pdfium', pdfium), patch('utils.PyPDF2.PdfReader') as reader:
+            reader.return_value.pages = [page]
+            self.assertEqual(extract_pdf_text(b'%PDF-1.4'), 'Invoice 42\n')
+
+class TestCreateChatCompletion(unittest.TestCase):
+    def setUp(self):
+        # Isolate from failures recorded by the shared breaker in other tests
+        patcher = patch('utils._openai_breaker', CircuitBreaker())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch('utils.time.sleep')
+    def test_retries_transient_errors(self, mock_sleep):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = [
+            openai.APIConnectionError(request=MagicMock()),
+            'response'
+        ]
+
+        self.assertEqual(create_chat_completion(client, model='test'), 'response')
+        self.assertEqual(client.chat.completions.create.call_count, 2)
+
+    @patch('utils.time.sleep')
+    def test_does_not_retry_other_errors(self, mock_sleep):
+        client = MagicMock()
+        client.chat.completions.create.side_effect = ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            create_chat_completion(client, model='test')
+        self.assertEqual(client.chat.completions.create.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
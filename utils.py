@@ -1,10 +1,23 @@
 import logging
 import os
-from typing import Optional
+import random
+import threading
+from typing import Optional, Callable, Any, Tuple, Type, TYPE_CHECKING
 import PyPDF2
 from io import BytesIO
 import time
-from functools import wraps
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache, wraps
+
+if TYPE_CHECKING:
+    import openai
+    from googleapiclient.errors import HttpError
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:  # optional speedup, fall back to PyPDF2
+    pdfium = None
 
 def setup_logging(log_file: str) -> None:
     """Configure logging"""
@@ -39,21 +52,235 @@ def rate_limit(max_per_minute: int):
         return wrapper
     return decorator
 
+class TokenBucket:
+    """Thread-safe token bucket allowing `rate` calls per `period` seconds"""
+
+    def __init__(self, rate: int, period: float = 60.0):
+        self.capacity = max(int(rate), 1)
+        self.fill_rate = self.capacity / period
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Block until a token is available, then consume it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+class CircuitOpenError(RuntimeError):
+    """Raised when a call is rejected because the circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Fail fast after `fail_max` consecutive failures until `reset_timeout` seconds pass.
+    Only exceptions of `counted_errors` are failures; others (e.g. a rejected request)
+    show the service is answering and are simply raised.
+    """
+
+    def __init__(self, fail_max: int = 5, reset_timeout: float = 30.0,
+                 counted_errors: Tuple[Type[BaseException], ...] = (Exception,)):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.counted_errors = counted_errors
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    def call(self, func: Callable[..., Any], *args, **kwargs) -> Any:
+        """Call func, tracking consecutive failures"""
+        with self.lock:
+            if self.opened_at is not None:
+                if self.trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+                    raise CircuitOpenError("Circuit breaker is open, skipping call")
+                # Half-open: let only this call through as a trial
+                self.trial_running = True
+
+        try:
+            result = func(*args, **kwargs)
+        except self.counted_errors:
+            with self.lock:
+                self.trial_running = False
+                self.failures += 1
+                # A failed trial reopens the circuit for another reset_timeout
+                if self.failures >= self.fail_max or self.opened_at is not None:
+                    self.opened_at = time.monotonic()
+            raise
+        except Exception:
+            with self.lock:
+                if self.trial_running:
+                    # The service answered, so the circuit can close
+                    self.trial_running = False
+                    self.opened_at = None
+                    self.failures = 0
+            raise
+
+        with self.lock:
+            self.trial_running = False
+            self.opened_at = None
+            self.failures = 0
+        return result
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Exponential backoff with full jitter for the given retry attempt"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# HTTP statuses of Google API errors worth retrying: rate limiting and transient server errors
+GOOGLE_RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+# Error reasons Google APIs give when a 403 means rate limiting rather than missing access
+GOOGLE_RATE_LIMIT_REASONS = frozenset({'rateLimitExceeded', 'userRateLimitExceeded'})
+# Longest wait in seconds between Google API retries, Retry-After included, so a long
+# quota reset fails the call instead of stalling the worker
+GOOGLE_MAX_RETRY_DELAY = 32.0
+
+def retry_after_delay(headers) -> Optional[float]:
+    """Seconds to wait according to a Retry-After header (seconds or HTTP date), None if absent"""
+    value = headers.get('retry-after') if headers else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def _is_rate_limited(error: 'HttpError') -> bool:
+    """Check whether a Google API error is a rate-limit rejection"""
+    if error.resp.status == 429:
+        return True
+    details = error.error_details if isinstance(error.error_details, list) else []
+    return error.resp.status == 403 and any(
+        isinstance(detail, dict) and detail.get('reason') in GOOGLE_RATE_LIMIT_REASONS
+        for detail in details
+    )
+
+def is_retryable_error(error: 'HttpError', statuses: tuple = GOOGLE_RETRYABLE_STATUSES) -> bool:
+    """Check whether a Google API error is worth retrying: a rate-limit rejection or one of statuses"""
+    return error.resp.status in statuses or _is_rate_limited(error)
+
+def execute_google_request(request: Any, retries: int = 5,
+                           statuses: tuple = GOOGLE_RETRYABLE_STATUSES, **kwargs) -> Any:
+    """
+    Execute a Google API request, retrying rate-limit errors and the given statuses.
+    Waits as long as the server's Retry-After header asks (re-raising when that exceeds
+    GOOGLE_MAX_RETRY_DELAY), otherwise backs off exponentially.
+    """
+    from googleapiclient.errors import HttpError
+
+    for attempt in range(retries + 1):
+        try:
+            return request.execute(**kwargs)
+        except HttpError as e:
+            if attempt == retries or not is_retryable_error(e, statuses):
+                raise
+            delay = retry_after_delay(e.resp)
+            if delay is None:
+                delay = backoff_delay(attempt, cap=GOOGLE_MAX_RETRY_DELAY)
+            elif delay > GOOGLE_MAX_RETRY_DELAY:
+                raise
+            logging.warning(f"Google API returned {e.resp.status}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+_openai_limiter = TokenBucket(int(os.getenv('OPENAI_RPM', 500)), 60.0)
+# Built on first use, so importing utils does not load the openai package
+_openai_breaker: Optional[CircuitBreaker] = None
+_openai_breaker_lock = threading.Lock()
+
+def _openai_retryable_errors() -> Tuple[Type[Exception], ...]:
+    """OpenAI errors that are transient and worth retrying"""
+    import openai
+    return (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+def _get_openai_breaker() -> CircuitBreaker:
+    """Return the shared OpenAI circuit breaker, creating it on first use"""
+    global _openai_breaker
+    if _openai_breaker is None:
+        with _openai_breaker_lock:
+            if _openai_breaker is None:
+                # Only transient errors open the breaker; e.g. an oversized prompt must not block other calls
+                _openai_breaker = CircuitBreaker(fail_max=5, reset_timeout=30.0,
+                                                 counted_errors=_openai_retryable_errors())
+    return _openai_breaker
+
+@lru_cache(maxsize=4)
+def get_openai_client(api_key: Optional[str] = None) -> 'openai.OpenAI':
+    """Return the process-wide OpenAI client for api_key, so callers share one connection pool"""
+    import openai
+    # Retries are handled by create_chat_completion
+    return openai.OpenAI(api_key=api_key, max_retries=0)
+
+def create_chat_completion(client, max_retries: int = 3, **kwargs):
+    """
+    Create an OpenAI chat completion behind the shared rate limiter and circuit breaker.
+    Rate-limit and transient errors are retried with jittered backoff; anything else
+    (e.g. authentication errors) is raised immediately.
+    """
+    retryable_errors = _openai_retryable_errors()
+
+    def _call():
+        for attempt in range(max_retries + 1):
+            _openai_limiter.acquire()
+            try:
+                return client.chat.completions.create(**kwargs)
+            except retryable_errors as e:
+                if attempt == max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logging.warning(f"OpenAI call failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    return _get_openai_breaker().call(_call)
+
+# PDFium must not be called from more than one thread at a time, even for different documents
+_pdfium_lock = threading.Lock()
+
 def extract_pdf_text(pdf_content: bytes) -> Optional[str]:
     """Extract text content from PDF"""
+    if pdfium is not None:
+        try:
+            with _pdfium_lock:
+                return _extract_pdf_text_pdfium(pdf_content)
+        except Exception as e:
+            logging.warning(f"PDFium could not extract PDF text, falling back to PyPDF2: {str(e)}")
+
     try:
         pdf_file = BytesIO(pdf_content)
         pdf_reader = PyPDF2.PdfReader(pdf_file)
-        text = ""
-        
-        for page in pdf_reader.pages:
-            text += page.extract_text() + "\n"
-        
-        return text
+        return "".join(page.extract_text() + "\n" for page in pdf_reader.pages)
     except Exception as e:
         logging.error(f"Error extracting PDF text: {str(e)}")
         return None
 
+def _extract_pdf_text_pdfium(pdf_content: bytes) -> str:
+    """Extract text content from PDF with PDFium, one line break after each page"""
+    pdf = pdfium.PdfDocument(pdf_content)
+    try:
+        texts = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            texts.append(textpage.get_text_range() + "\n")
+            textpage.close()
+            page.close()
+        return "".join(texts)
+    finally:
+        pdf.close()
+
 def ensure_directory_exists(directory: str) -> None:
     """Create directory if it doesn't exist"""
     if not os.path.exists(directory):